@@ -12,22 +12,52 @@ Gestisce:
 """
 
 import os
+import sys
+import html
 import json
+import logging
 import re
 import base64
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 from typing import Optional, List, Dict, Any
 from dataclasses import dataclass, asdict, field
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from operator import attrgetter
 import calendar
 
+# orjson è opzionale: serializza molto più velocemente di json, altrimenti
+# si usa la stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# NumPy/Numba sono opzionali: se installati, il loop di consolidamento gira
+# compilato; altrimenti lo stesso codice gira come puro Python.
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+logger = logging.getLogger(__name__)
+
 # Scope necessari per leggere le email
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
@@ -36,6 +66,8 @@ BASE_DIR = Path(__file__).parent.parent
 CREDENTIALS_FILE = BASE_DIR / 'credentials.json'
 TOKEN_FILE = BASE_DIR / 'token.json'
 DATA_FILE = BASE_DIR / 'data' / 'servizi.json'
+EMAIL_CACHE_FILE = BASE_DIR / 'data' / 'email_cache.json'
+SYNC_STATE_FILE = BASE_DIR / 'data' / 'sync_state.json'
 
 # Mittente delle email di notifica turni (configurabile via variabile d'ambiente)
 MEMO_SENDER = os.environ.get('MEMO_SENDER', 'noreply@example.com')
@@ -43,51 +75,85 @@ MEMO_SENDER = os.environ.get('MEMO_SENDER', 'noreply@example.com')
 # Ore standard di un turno (per calcolo straordinario)
 ORE_TURNO_STANDARD = 6.0
 
+# Limiti della fascia diurna in minuti (06:00 - 22:00)
+DIURNO_START = 6 * 60
+DIURNO_END = 22 * 60
+
 # ID dipendente (configurabile via variabile d'ambiente)
 EMPLOYEE_ID = os.environ.get('EMPLOYEE_ID', '000000')
 
+# Numero massimo di richieste per batch Gmail API (limite del server: 100)
+BATCH_SIZE = 100
+
+
+# Sostituzioni per generalizzare il dettaglio - ordine importante!
+# Le regole sono fuse in un'unica alternanza compilata: una sola passata
+# lineare sulla stringa invece di una scansione completa per regola.
+# L'ordine dei gruppi preserva la priorità: a parità di posizione il motore
+# regex prova le alternative da sinistra a destra.
+_SANITIZE_RULES = [
+    # Riferimenti legali e sigle
+    (r'\s*\(ex art\.\d+\s*L\.\s*\d+/\d+\s*-\s*U\.C\.I\.S\.', ''),
+    (r'U\.?C\.?I\.?S\.?', ''),
+
+    # Servizi specifici militari/polizia
+    (r'Militare servizio caserma/addetto ricezione pubblico.*', 'Servizio interno'),
+    (r'Militare servizio caserma.*', 'Servizio interno'),
+    (r'servizio caserma.*', 'Servizio interno'),
+    (r'Scorta a persona.*', 'Servizio esterno'),
+    (r'Indagini di Polizia Giudiziaria', 'Attività operativa'),
+    (r'Polizia Giudiziaria', 'Attività operativa'),
+    (r'Accompagnamento a collaboratore di giustizia.*', 'Servizio esterno'),
+    (r'collaboratore di giustizia', 'soggetto protetto'),
+    (r'Testimonianza per fatti inerenti al servizio', 'Impegno istituzionale'),
+    (r'Testimonianza.*', 'Impegno istituzionale'),
+
+    # Termini militari generici
+    (r'\bMilitare\b', 'Operatore'),
+    (r'\bmilitare\b', 'operatore'),
+    (r'\bCarabinieri\b', 'Ente'),
+    (r'\bcarabinieri\b', 'ente'),
+    (r'\bArma\b', 'Ente'),
+    (r'\bcaserma\b', 'sede'),
+    (r'\bCaserma\b', 'Sede'),
+]
+
+_SANITIZE_ALT_RE = re.compile(
+    '|'.join(f'(?P<g{i}>{pattern})' for i, (pattern, _) in enumerate(_SANITIZE_RULES)),
+    re.IGNORECASE
+)
+_SANITIZE_REPLS = [replacement for _, replacement in _SANITIZE_RULES]
+
+
+def _sanitize_dispatch(m: re.Match) -> str:
+    """Restituisce la sostituzione della regola che ha fatto match."""
+    return _SANITIZE_REPLS[int(m.lastgroup[1:])]
+
 
 def sanitize_dettaglio(dettaglio: str) -> str:
     """Rimuove riferimenti identificativi dal campo dettaglio."""
     if not dettaglio:
         return dettaglio
 
-    # Sostituzioni per generalizzare - ordine importante!
-    replacements = [
-        # Riferimenti legali e sigle
-        (r'\s*\(ex art\.\d+\s*L\.\s*\d+/\d+\s*-\s*U\.C\.I\.S\.', ''),
-        (r'U\.?C\.?I\.?S\.?', ''),
-
-        # Servizi specifici militari/polizia
-        (r'Militare servizio caserma/addetto ricezione pubblico.*', 'Servizio interno'),
-        (r'Militare servizio caserma.*', 'Servizio interno'),
-        (r'servizio caserma.*', 'Servizio interno'),
-        (r'Scorta a persona.*', 'Servizio esterno'),
-        (r'Indagini di Polizia Giudiziaria', 'Attività operativa'),
-        (r'Polizia Giudiziaria', 'Attività operativa'),
-        (r'Accompagnamento a collaboratore di giustizia.*', 'Servizio esterno'),
-        (r'collaboratore di giustizia', 'soggetto protetto'),
-        (r'Testimonianza per fatti inerenti al servizio', 'Impegno istituzionale'),
-        (r'Testimonianza.*', 'Impegno istituzionale'),
-
-        # Termini militari generici
-        (r'\bMilitare\b', 'Operatore'),
-        (r'\bmilitare\b', 'operatore'),
-        (r'\bCarabinieri\b', 'Ente'),
-        (r'\bcarabinieri\b', 'ente'),
-        (r'\bArma\b', 'Ente'),
-        (r'\bcaserma\b', 'sede'),
-        (r'\bCaserma\b', 'Sede'),
-    ]
+    return _SANITIZE_ALT_RE.sub(_sanitize_dispatch, dettaglio).strip()
+
+
+def _time_to_minutes(time_str: str) -> int:
+    """Converte 'HH:MM' in minuti dalla mezzanotte (0 se vuoto/invalido)."""
+    try:
+        h, m = time_str.split(':')
+        return int(h) * 60 + int(m)
+    except (ValueError, AttributeError):
+        return 0
 
-    result = dettaglio
-    for pattern, replacement in replacements:
-        result = re.sub(pattern, replacement, result, flags=re.IGNORECASE)
 
-    return result.strip()
+# Le due varianti di recupero in un'unica alternanza compilata: una sola
+# scansione del dettaglio invece di due ricerche di sottostringa
+_RECUP_RE = re.compile(r'recupero di ore (prestate nel mese|non retribuite)',
+                       re.IGNORECASE)
 
 
-@dataclass
+@dataclass(slots=True)
 class Turno:
     """Rappresenta un singolo turno di servizio."""
     id: str
@@ -104,16 +170,42 @@ class Turno:
     email_date: str  # Timestamp email per determinare quale è più recente
     email_id: str
     stato: str  # attivo, eliminato
+    # Orari precalcolati in minuti: il consolidamento confronta interi
+    # invece di rifare split/int sulle stringhe HH:MM ad ogni confronto
+    _start_min: int = field(init=False, default=0, repr=False)
+    _end_min: int = field(init=False, default=0, repr=False)
+    # Flag precalcolati sul dettaglio: le statistiche li leggono per ogni
+    # turno, quindi il lower() e le ricerche si fanno una volta sola qui
+    _is_esterno: bool = field(init=False, default=False, repr=False)
+    _recupero_kind: int = field(init=False, default=0, repr=False)  # 0=no, 1=mese, 2=non retribuite
+
+    def __post_init__(self):
+        self._start_min = _time_to_minutes(self.ora_inizio)
+        self._end_min = _time_to_minutes(self.ora_fine)
+
+        dettaglio_lower = self.dettaglio.lower()
+        self._is_esterno = (
+            'scorta' in dettaglio_lower
+            or 'esterno' in dettaglio_lower
+            or 'accompagn' in dettaglio_lower
+        )
+        m = _RECUP_RE.search(dettaglio_lower)
+        if m:
+            self._recupero_kind = 1 if m.group(1) == 'prestate nel mese' else 2
 
     def to_dict(self):
         # Escludi matricola e sanitizza dettaglio per privacy
         d = asdict(self)
         d.pop('matricola', None)
+        d.pop('_start_min', None)
+        d.pop('_end_min', None)
+        d.pop('_is_esterno', None)
+        d.pop('_recupero_kind', None)
         d['dettaglio'] = sanitize_dettaglio(d.get('dettaglio', ''))
         return d
 
 
-@dataclass
+@dataclass(slots=True)
 class Licenza:
     """Rappresenta una domanda di licenza."""
     id: str
@@ -129,7 +221,7 @@ class Licenza:
         return asdict(self)
 
 
-@dataclass
+@dataclass(slots=True)
 class Giornata:
     """Rappresenta tutti i turni di una giornata."""
     data: str
@@ -139,6 +231,12 @@ class Giornata:
     ore_straordinario: float = 0.0
     is_licenza: bool = False
     tipo_licenza: str = ""
+    # Chiave mese (YYYY-MM) precalcolata: le statistiche la usano per ogni
+    # giornata, lo slice si fa una volta sola qui
+    _mese: str = field(init=False, default="", repr=False)
+
+    def __post_init__(self):
+        self._mese = self.data[:7]
 
     def to_dict(self):
         return {
@@ -152,19 +250,23 @@ class Giornata:
         }
 
 
-# Mappa mesi italiani
-MESI = {
-    'gennaio': '01', 'febbraio': '02', 'marzo': '03', 'aprile': '04',
-    'maggio': '05', 'giugno': '06', 'luglio': '07', 'agosto': '08',
-    'settembre': '09', 'ottobre': '10', 'novembre': '11', 'dicembre': '12'
+# Mappa mesi italiani: le prime tre lettere bastano a distinguerli,
+# quindi il lookup lavora su una chiave corta invece del nome intero
+MESI_BY_PREFIX = {
+    'gen': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'mag': 5, 'giu': 6,
+    'lug': 7, 'ago': 8, 'set': 9, 'ott': 10, 'nov': 11, 'dic': 12
 }
 
 
+@lru_cache(maxsize=16)
 def get_festivi_italiani(anno: int) -> Dict[str, str]:
     """
     Restituisce i giorni festivi italiani per l'anno specificato.
     Chiave: data in formato YYYY-MM-DD
     Valore: nome della festività
+
+    Il risultato è cachato per anno (il calcolo della Pasqua non viene
+    ripetuto): i chiamanti non devono mutare il dict restituito.
     """
     festivi = {
         f"{anno}-01-01": "Capodanno",
@@ -211,12 +313,16 @@ def get_festivi_italiani(anno: int) -> Dict[str, str]:
 
 def get_all_sundays(anno: int, mese_inizio: int = 1, mese_fine: int = 12) -> List[str]:
     """Restituisce tutte le domeniche dell'anno (o range di mesi)."""
+    # Forma chiusa: trova la prima domenica del range e avanza di 7 giorni,
+    # invece di iterare ogni giorno di ogni mese con calendar
+    d = date(anno, mese_inizio, 1)
+    d += timedelta(days=(6 - d.weekday()) % 7)  # 6 = domenica
+    end = date(anno, mese_fine, calendar.monthrange(anno, mese_fine)[1])
+
     domeniche = []
-    for mese in range(mese_inizio, mese_fine + 1):
-        cal = calendar.Calendar()
-        for giorno in cal.itermonthdays2(anno, mese):
-            if giorno[0] != 0 and giorno[1] == 6:  # 6 = domenica
-                domeniche.append(f"{anno}-{str(mese).zfill(2)}-{str(giorno[0]).zfill(2)}")
+    while d <= end:
+        domeniche.append(d.isoformat())
+        d += timedelta(days=7)
     return domeniche
 
 
@@ -247,95 +353,133 @@ def get_gmail_service():
     return build('gmail', 'v1', credentials=creds)
 
 
-def strip_html_tags(html: str) -> str:
+# <br> diventa newline (gruppo 1), ogni altro tag viene rimosso
+_HTML_TAG_RE = re.compile(r'(<br\s*/?>)|<[^>]+>', re.IGNORECASE)
+
+
+def _html_tag_sub(m: re.Match) -> str:
+    return '\n' if m.group(1) else ''
+
+
+def strip_html_tags(html_text: str) -> str:
     """Rimuove i tag HTML e converte in testo."""
-    # Sostituisci <br> con newline
-    text = re.sub(r'<br\s*/?>', '\n', html, flags=re.IGNORECASE)
-    # Rimuovi tutti gli altri tag HTML
-    text = re.sub(r'<[^>]+>', '', text)
-    # Decodifica entità HTML comuni
-    text = text.replace('&nbsp;', ' ')
-    text = text.replace('&amp;', '&')
-    text = text.replace('&lt;', '<')
-    text = text.replace('&gt;', '>')
-    text = text.replace('&quot;', '"')
-    return text
+    # Un'unica passata regex per tag e <br>, poi html.unescape (implementato
+    # in C, copre tutte le entità nominate) al posto dei replace manuali
+    text = _HTML_TAG_RE.sub(_html_tag_sub, html_text)
+    return html.unescape(text).replace('\xa0', ' ')
 
 
 def get_email_body(msg) -> str:
-    """Estrae il corpo testuale da un messaggio Gmail."""
-    body = ""
+    """Estrae il corpo testuale da un messaggio Gmail.
 
-    # Prima prova text/plain
-    if 'parts' in msg['payload']:
-        for part in msg['payload']['parts']:
+    Una sola passata sulle parti MIME: si ferma alla prima text/plain
+    (preferita) e decodifica/strippa il fallback HTML solo se il plain
+    è assente — niente decodifiche inutili di parti scartate.
+    """
+    payload = msg['payload']
+
+    if 'parts' in payload:
+        html_data = None
+        for part in payload['parts']:
+            data = part['body'].get('data')
+            if not data:
+                continue
             if part['mimeType'] == 'text/plain':
-                if 'data' in part['body']:
-                    body = base64.urlsafe_b64decode(
-                        part['body']['data']
-                    ).decode('utf-8', errors='ignore')
-                    break
-        # Se non trovato text/plain, prova text/html
-        if not body:
-            for part in msg['payload']['parts']:
-                if part['mimeType'] == 'text/html':
-                    if 'data' in part['body']:
-                        html = base64.urlsafe_b64decode(
-                            part['body']['data']
-                        ).decode('utf-8', errors='ignore')
-                        body = strip_html_tags(html)
-                        break
-    elif 'body' in msg['payload'] and 'data' in msg['payload']['body']:
+                # Preferito: decodifica e basta
+                return base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+            if part['mimeType'] == 'text/html' and html_data is None:
+                html_data = data
+        if html_data:
+            raw = base64.urlsafe_b64decode(html_data).decode('utf-8', errors='ignore')
+            return strip_html_tags(raw)
+    elif 'body' in payload and 'data' in payload['body']:
         raw = base64.urlsafe_b64decode(
-            msg['payload']['body']['data']
+            payload['body']['data']
         ).decode('utf-8', errors='ignore')
         # Controlla se è HTML
         if '<br' in raw.lower() or '<b>' in raw.lower():
-            body = strip_html_tags(raw)
-        else:
-            body = raw
+            return strip_html_tags(raw)
+        return raw
+
+    return ""
 
-    return body
 
+def get_email_headers(msg) -> Dict[str, str]:
+    """Indicizza gli header del messaggio in un dict {nome_minuscolo: valore}.
 
-def get_email_date(msg) -> str:
+    Costruito una sola volta per messaggio: gli estrattori successivi fanno
+    lookup O(1) invece di riscandire la lista header per ogni campo.
+    """
+    return {h['name'].lower(): h['value'] for h in msg['payload'].get('headers', [])}
+
+
+def get_email_date(hdrs: Dict[str, str]) -> str:
     """Estrae la data di ricezione dell'email come timestamp ISO."""
-    headers = msg['payload'].get('headers', [])
-    for header in headers:
-        if header['name'].lower() == 'date':
-            try:
-                date_str = header['value']
-                date_str = re.sub(r'\s*\([^)]+\)\s*$', '', date_str)
-                date_str = re.sub(r'\s*[+-]\d{4}\s*$', '', date_str)
-
-                for fmt in [
-                    '%a, %d %b %Y %H:%M:%S',
-                    '%d %b %Y %H:%M:%S',
-                    '%a %d %b %Y %H:%M:%S'
-                ]:
-                    try:
-                        dt = datetime.strptime(date_str.strip(), fmt)
-                        return dt.isoformat()
-                    except:
-                        continue
-            except:
-                pass
+    date_str = hdrs.get('date')
+    if date_str:
+        try:
+            # parsedate_to_datetime gestisce tutte le varianti RFC 5322
+            # (timezone incluse) in una sola chiamata C-level
+            return parsedate_to_datetime(date_str).isoformat()
+        except Exception:
+            pass
     return datetime.now().isoformat()
 
 
-def get_email_subject(msg) -> str:
+def get_email_subject(hdrs: Dict[str, str]) -> str:
     """Estrae l'oggetto dell'email."""
-    headers = msg['payload'].get('headers', [])
-    for header in headers:
-        if header['name'].lower() == 'subject':
-            return header['value']
-    return ""
+    return hdrs.get('subject', "")
 
 
 def parse_data_italiana(giorno: str, mese: str, anno: str) -> str:
     """Converte data italiana in formato YYYY-MM-DD."""
-    mese_num = MESI.get(mese.lower(), '01')
-    return f"{anno}-{mese_num}-{giorno.zfill(2)}"
+    mese_num = MESI_BY_PREFIX.get(mese[:3].lower(), 1)
+    return f"{anno}-{mese_num:02d}-{int(giorno):02d}"
+
+
+def _abs_minutes(giorno: str, mese: str, anno: str, ora: str) -> int:
+    """Converte data italiana + ora HH:MM in minuti assoluti dall'epoca.
+
+    Evita datetime.strptime (che ri-analizza la stringa formato ad ogni
+    chiamata): bastano l'ordinale del giorno e l'aritmetica sui minuti.
+    """
+    mese_num = MESI_BY_PREFIX.get(mese[:3].lower(), 1)
+    h, m = ora.split(':')
+    return (date(int(anno), mese_num, int(giorno)).toordinal() * 1440
+            + int(h) * 60 + int(m))
+
+
+# Pattern per le email di turno/eliminazione/licenza, compilati una volta sola.
+# I quattro campi dell'email turno (tipo, matricola, inizio, fine) vengono
+# estratti con un'unica regex multi-gruppo: una sola scansione del body invece
+# di quattro. Il blocco Fine è opzionale (alcune email ne sono prive).
+_TURNO_RE = re.compile(
+    r'Servizio di\s+(?P<tipo>\w+)\s*\((?P<dettaglio>[^)]+)\)'
+    r'.*?Matricola[^:]*:\s*(?P<matricola>\d+)'
+    r'.*?Inizio:\s*ore\s*(?P<ih>\d{1,2}[:.]\d{2})\s*del giorno\s*(?P<ig>\d{1,2})/(?P<im>\w+)/(?P<iy>\d{4})'
+    r'(?:.*?Fine:\s*ore\s*(?P<fh>\d{1,2}[:.]\d{2})\s*del giorno\s*(?P<fg>\d{1,2})/(?P<fm>\w+)/(?P<fy>\d{4}))?',
+    re.IGNORECASE | re.DOTALL
+)
+_INIZIO_RE = re.compile(
+    r'Inizio:\s*ore\s*(\d{1,2}[:.]\d{2})\s*del giorno\s*(\d{1,2})/(\w+)/(\d{4})',
+    re.IGNORECASE
+)
+_FINE_RE = re.compile(
+    r'Fine:\s*ore\s*(\d{1,2}[:.]\d{2})\s*del giorno\s*(\d{1,2})/(\w+)/(\d{4})',
+    re.IGNORECASE
+)
+_ELIM_SUBJECT_RE = re.compile(
+    r'Eliminazione turno pianificato per il giorno\s*(\d{1,2})/(\d{1,2})/(\d{4})'
+)
+_PARENS_RE = re.compile(r'\(([^)]+)\)')
+_STATO_RE = re.compile(r'in stato\s+(\w+)', re.IGNORECASE)
+_LICENZA_INIZIO_RE = re.compile(
+    r'Data inizio:\s*(\d{1,2})/(\w+)/(\d{4})', re.IGNORECASE
+)
+_LICENZA_FINE_RE = re.compile(
+    r'Data fine:\s*(\d{1,2})/(\w+)/(\d{4})', re.IGNORECASE
+)
+_FRUIZIONE_RE = re.compile(r'Tipo fruizione:\s*(.+?)(?:\n|$)', re.IGNORECASE)
 
 
 def parse_turno_servizio(body: str, email_date: str, msg_id: str, subject: str) -> Optional[Turno]:
@@ -349,69 +493,31 @@ def parse_turno_servizio(body: str, email_date: str, msg_id: str, subject: str)
     Fine: ore 17:30 del giorno 15/dicembre/2025
     """
     try:
-        # Pattern per il tipo di servizio
-        tipo_match = re.search(
-            r'Servizio di\s+(\w+)\s*\(([^)]+)\)',
-            body,
-            re.IGNORECASE
-        )
-
-        # Pattern per matricola (generico)
-        matricola_match = re.search(
-            r'Matricola[^:]*:\s*(\d+)',
-            body
-        )
-
-        # Pattern per data/ora inizio
-        inizio_match = re.search(
-            r'Inizio:\s*ore\s*(\d{1,2}[:.]\d{2})\s*del giorno\s*(\d{1,2})/(\w+)/(\d{4})',
-            body,
-            re.IGNORECASE
-        )
-
-        # Pattern per data/ora fine (opzionale - alcune email non ce l'hanno)
-        fine_match = re.search(
-            r'Fine:\s*ore\s*(\d{1,2}[:.]\d{2})\s*del giorno\s*(\d{1,2})/(\w+)/(\d{4})',
-            body,
-            re.IGNORECASE
-        )
-
-        # Verifica campi obbligatori
-        if not all([tipo_match, matricola_match, inizio_match]):
+        # Un'unica scansione del body per tutti i campi obbligatori
+        m = _TURNO_RE.search(body)
+        if not m:
             return None
 
         # Se manca "Fine", ignora l'email (incompleta)
-        if not fine_match:
-            print(f"  [SKIP] Email {msg_id}: manca orario Fine (email incompleta)")
+        if m.group('fh') is None:
+            logger.debug("[SKIP] Email %s: manca orario Fine (email incompleta)", msg_id)
             return None
 
-        tipo_servizio = tipo_match.group(1).strip().upper()
-        dettaglio = tipo_match.group(2).strip()
-        matricola = matricola_match.group(1)
+        tipo_servizio = m.group('tipo').strip().upper()
+        dettaglio = m.group('dettaglio').strip()
+        matricola = m.group('matricola')
 
         # Parse inizio
-        ora_inizio = inizio_match.group(1).replace('.', ':')
-        data = parse_data_italiana(
-            inizio_match.group(2),
-            inizio_match.group(3),
-            inizio_match.group(4)
-        )
+        ora_inizio = m.group('ih').replace('.', ':')
+        data = parse_data_italiana(m.group('ig'), m.group('im'), m.group('iy'))
 
         # Parse fine
-        ora_fine = fine_match.group(1).replace('.', ':')
-        data_fine = parse_data_italiana(
-            fine_match.group(2),
-            fine_match.group(3),
-            fine_match.group(4)
-        )
+        ora_fine = m.group('fh').replace('.', ':')
 
-        # Calcola durata
-        dt_inizio = datetime.strptime(f"{data} {ora_inizio}", "%Y-%m-%d %H:%M")
-        dt_fine = datetime.strptime(f"{data_fine} {ora_fine}", "%Y-%m-%d %H:%M")
-        durata = (dt_fine - dt_inizio).total_seconds() / 3600
-
-        if durata < 0:
-            durata = 0
+        # Calcola durata con aritmetica sui minuti (niente strptime)
+        inizio_min = _abs_minutes(m.group('ig'), m.group('im'), m.group('iy'), ora_inizio)
+        fine_min = _abs_minutes(m.group('fg'), m.group('fm'), m.group('fy'), ora_fine)
+        durata = max(0, fine_min - inizio_min) / 60.0
 
         # Calcola ore ordinarie vs straordinario
         ore_ordinarie = min(durata, ORE_TURNO_STANDARD)
@@ -436,7 +542,7 @@ def parse_turno_servizio(body: str, email_date: str, msg_id: str, subject: str)
         )
 
     except Exception as e:
-        print(f"  [ERROR] Parsing turno {msg_id}: {e}")
+        logger.error("Parsing turno %s: %s", msg_id, e)
         return None
 
 
@@ -454,11 +560,7 @@ def parse_eliminazione_turno(body: str, email_date: str, msg_id: str, subject: s
     """
     try:
         # Prima prova a estrarre dal body (più preciso)
-        inizio_match = re.search(
-            r'Inizio:\s*ore\s*(\d{1,2}[:.]\d{2})\s*del giorno\s*(\d{1,2})/(\w+)/(\d{4})',
-            body,
-            re.IGNORECASE
-        )
+        inizio_match = _INIZIO_RE.search(body)
 
         if inizio_match:
             ora_inizio = inizio_match.group(1).replace('.', ':')
@@ -469,11 +571,7 @@ def parse_eliminazione_turno(body: str, email_date: str, msg_id: str, subject: s
             )
 
             # Estrai anche ora fine se presente
-            fine_match = re.search(
-                r'Fine:\s*ore\s*(\d{1,2}[:.]\d{2})\s*del giorno\s*(\d{1,2})/(\w+)/(\d{4})',
-                body,
-                re.IGNORECASE
-            )
+            fine_match = _FINE_RE.search(body)
             ora_fine = fine_match.group(1).replace('.', ':') if fine_match else ""
 
             return {
@@ -486,10 +584,7 @@ def parse_eliminazione_turno(body: str, email_date: str, msg_id: str, subject: s
             }
 
         # Fallback: estrai data dall'oggetto
-        data_match = re.search(
-            r'Eliminazione turno pianificato per il giorno\s*(\d{1,2})/(\d{1,2})/(\d{4})',
-            subject
-        )
+        data_match = _ELIM_SUBJECT_RE.search(subject)
 
         if data_match:
             giorno = data_match.group(1).zfill(2)
@@ -509,7 +604,7 @@ def parse_eliminazione_turno(body: str, email_date: str, msg_id: str, subject: s
         return None
 
     except Exception as e:
-        print(f"  [ERROR] Parsing eliminazione {msg_id}: {e}")
+        logger.error("Parsing eliminazione %s: %s", msg_id, e)
         return None
 
 
@@ -541,12 +636,12 @@ def parse_licenza(body: str, email_date: str, msg_id: str, subject: str) -> Opti
 
         if "straordinaria" in subject_lower:
             tipo_licenza = "straordinaria"
-            motivo_match = re.search(r'\(([^)]+)\)', subject)
+            motivo_match = _PARENS_RE.search(subject)
             if motivo_match:
                 motivo = motivo_match.group(1)
         elif "speciale" in subject_lower:
             tipo_licenza = "speciale"
-            motivo_match = re.search(r'\(([^)]+)\)', subject)
+            motivo_match = _PARENS_RE.search(subject)
             if motivo_match:
                 motivo = motivo_match.group(1)
         elif "riposo per donatori" in subject_lower:
@@ -554,11 +649,7 @@ def parse_licenza(body: str, email_date: str, msg_id: str, subject: str) -> Opti
             motivo = "donazione sangue"
 
         # Estrai stato dall'oggetto
-        stato_match = re.search(
-            r'in stato\s+(\w+)',
-            subject,
-            re.IGNORECASE
-        )
+        stato_match = _STATO_RE.search(subject)
         if stato_match:
             stato = stato_match.group(1)
 
@@ -567,11 +658,7 @@ def parse_licenza(body: str, email_date: str, msg_id: str, subject: str) -> Opti
         data_inizio = ""
         data_fine = ""
 
-        inizio_match = re.search(
-            r'Data inizio:\s*(\d{1,2})/(\w+)/(\d{4})',
-            body,
-            re.IGNORECASE
-        )
+        inizio_match = _LICENZA_INIZIO_RE.search(body)
         if inizio_match:
             data_inizio = parse_data_italiana(
                 inizio_match.group(1),
@@ -579,11 +666,7 @@ def parse_licenza(body: str, email_date: str, msg_id: str, subject: str) -> Opti
                 inizio_match.group(3)
             )
 
-        fine_match = re.search(
-            r'Data fine:\s*(\d{1,2})/(\w+)/(\d{4})',
-            body,
-            re.IGNORECASE
-        )
+        fine_match = _LICENZA_FINE_RE.search(body)
         if fine_match:
             data_fine = parse_data_italiana(
                 fine_match.group(1),
@@ -592,11 +675,7 @@ def parse_licenza(body: str, email_date: str, msg_id: str, subject: str) -> Opti
             )
 
         # Estrai tipo fruizione
-        fruizione_match = re.search(
-            r'Tipo fruizione:\s*(.+?)(?:\n|$)',
-            body,
-            re.IGNORECASE
-        )
+        fruizione_match = _FRUIZIONE_RE.search(body)
         if fruizione_match:
             tipo_fruizione = fruizione_match.group(1).strip()
 
@@ -616,7 +695,7 @@ def parse_licenza(body: str, email_date: str, msg_id: str, subject: str) -> Opti
         )
 
     except Exception as e:
-        print(f"  [ERROR] Parsing licenza {msg_id}: {e}")
+        logger.error("Parsing licenza %s: %s", msg_id, e)
         return None
 
 
@@ -635,7 +714,11 @@ def classify_email(subject: str) -> str:
 
 
 def load_existing_data() -> Optional[Dict]:
-    """Carica i dati esistenti se presenti."""
+    """
+    Carica i dati esistenti se presenti.
+    Il filtro per anno avviene a valle, dentro merge_with_existing,
+    fuso con la passata di dedupe.
+    """
     if DATA_FILE.exists():
         try:
             with open(DATA_FILE, 'r', encoding='utf-8') as f:
@@ -645,6 +728,179 @@ def load_existing_data() -> Optional[Dict]:
     return None
 
 
+def load_sync_state() -> Dict[str, Any]:
+    """Carica lo stato di sincronizzazione (historyId dell'ultimo sync)."""
+    if SYNC_STATE_FILE.exists():
+        try:
+            with open(SYNC_STATE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except:
+            return {}
+    return {}
+
+
+def save_sync_state(state: Dict[str, Any]):
+    """Salva lo stato di sincronizzazione in modo atomico."""
+    SYNC_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = SYNC_STATE_FILE.with_suffix('.json.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, SYNC_STATE_FILE)
+
+
+def load_email_cache() -> Dict[str, Optional[Dict]]:
+    """Carica la cache {msg_id: email estratta, None se irrilevante}."""
+    if EMAIL_CACHE_FILE.exists():
+        try:
+            with open(EMAIL_CACHE_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except:
+            return {}
+    return {}
+
+
+def save_email_cache(cache: Dict[str, Optional[Dict]]):
+    """Salva la cache in modo atomico (scrittura su tmp + rename)."""
+    EMAIL_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = EMAIL_CACHE_FILE.with_suffix('.json.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_file, EMAIL_CACHE_FILE)
+
+
+def _fetch_batch(service, ids: List[str], **get_kwargs) -> Dict[str, Dict]:
+    """Recupera messaggi a blocchi via endpoint batch. Ritorna {id: messaggio}."""
+    results: Dict[str, Dict] = {}
+
+    def on_message(request_id, response, exception):
+        if exception is not None:
+            logger.error("Recupero %s: %s", request_id, exception)
+            return
+        results[response['id']] = response
+
+    for batch_start in range(0, len(ids), BATCH_SIZE):
+        chunk = ids[batch_start:batch_start + BATCH_SIZE]
+        batch = service.new_batch_http_request(callback=on_message)
+        for mid in chunk:
+            batch.add(
+                service.users().messages().get(userId='me', id=mid, **get_kwargs),
+                request_id=mid
+            )
+        batch.execute()
+
+    return results
+
+
+def fetch_metadata_batch(service, ids: List[str]) -> Dict[str, Dict]:
+    """Recupera solo gli header Subject/Date/From (formato metadata, leggero)."""
+    return _fetch_batch(
+        service, ids,
+        format='metadata',
+        metadataHeaders=['Subject', 'Date', 'From']
+    )
+
+
+def fetch_full_batch(service, ids: List[str]) -> Dict[str, Dict]:
+    """Recupera i messaggi completi (corpo incluso)."""
+    return _fetch_batch(service, ids, format='full')
+
+
+def _parse_one(email: Dict) -> tuple:
+    """Classifica e parsa una singola email. Ritorna (tipo, record|None)."""
+    email_type = classify_email(email['subject'])
+
+    if email_type == "turno":
+        return email_type, parse_turno_servizio(
+            email['body'], email['email_date'], email['id'], email['subject']
+        )
+    if email_type == "eliminazione":
+        return email_type, parse_eliminazione_turno(
+            email['body'], email['email_date'], email['id'], email['subject']
+        )
+    if email_type == "licenza":
+        return email_type, parse_licenza(
+            email['body'], email['email_date'], email['id'], email['subject']
+        )
+    return email_type, None
+
+
+def _email_sort_key(email: Dict) -> int:
+    """Chiave di ordinamento cronologico: internalDate in ms dall'epoca.
+
+    Le voci di cache create prima dell'introduzione di internal_ts
+    ricavano il timestamp dall'email_date ISO già memorizzato.
+    """
+    ts = email.get('internal_ts')
+    if ts:
+        return ts
+    try:
+        return int(datetime.fromisoformat(email['email_date']).timestamp() * 1000)
+    except (KeyError, ValueError):
+        return 0
+
+
+def _list_message_ids(service, query: str) -> List[str]:
+    """Elenca gli ID dei messaggi che soddisfano la query (con paginazione)."""
+    ids = []
+    page_token = None
+    page_num = 1
+
+    while True:
+        logger.debug("Recuperando pagina %d...", page_num)
+
+        params = {'userId': 'me', 'q': query, 'maxResults': 500}
+        if page_token:
+            params['pageToken'] = page_token
+        results = service.users().messages().list(**params).execute()
+
+        batch = results.get('messages', [])
+        ids.extend(m['id'] for m in batch)
+        logger.debug("-> %d email in questa pagina (totale: %d)", len(batch), len(ids))
+
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+        page_num += 1
+
+    return ids
+
+
+def _list_history_message_ids(service, start_history_id: str) -> List[str]:
+    """Elenca gli ID dei messaggi aggiunti dopo start_history_id.
+
+    Usa il delta lato server (history API): il mittente va poi verificato
+    dal chiamante, perché la history non filtra per from:.
+    Solleva HttpError 404 se lo startHistoryId è scaduto.
+    """
+    ids = []
+    seen = set()
+    page_token = None
+
+    while True:
+        params = {
+            'userId': 'me',
+            'startHistoryId': start_history_id,
+            'historyTypes': ['messageAdded'],
+            'maxResults': 500
+        }
+        if page_token:
+            params['pageToken'] = page_token
+        results = service.users().history().list(**params).execute()
+
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                mid = added['message']['id']
+                if mid not in seen:
+                    seen.add(mid)
+                    ids.append(mid)
+
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+
+    return ids
+
+
 def process_emails(service, anno: int = None, is_first_sync: bool = True) -> Dict[str, Any]:
     """
     Recupera e processa le email di notifica turni.
@@ -658,128 +914,183 @@ def process_emails(service, anno: int = None, is_first_sync: bool = True) -> Dic
     if anno is None:
         anno = datetime.now().year
 
-    print(f"Cercando email da {MEMO_SENDER}...")
+    logger.info("Cercando email da %s...", MEMO_SENDER)
 
     # Strutture per raccogliere i dati
     turni_per_data: Dict[str, List[Turno]] = defaultdict(list)
     eliminazioni: List[Dict] = []
     licenze: List[Licenza] = []
 
-    # Costruisci la query in base al tipo di sincronizzazione
-    if is_first_sync:
-        # Prima sync: tutto l'anno corrente
-        query = f'from:{MEMO_SENDER} after:{anno}/01/01'
-        print(f"  -> PRIMA SINCRONIZZAZIONE: scarico tutto dal 1 gennaio {anno}")
-    else:
-        # Sync successiva: solo ultime 3 settimane
-        three_weeks_ago = (datetime.now() - timedelta(weeks=3)).strftime('%Y/%m/%d')
-        query = f'from:{MEMO_SENDER} after:{three_weeks_ago}'
-        print(f"  -> SINCRONIZZAZIONE INCREMENTALE: ultime 3 settimane (dal {three_weeks_ago})")
+    sync_state = load_sync_state()
 
     try:
-        # Usa paginazione per recuperare TUTTE le email
-        messages = []
-        page_token = None
-        page_num = 1
-
-        while True:
-            print(f"  Recuperando pagina {page_num}...")
-
-            if page_token:
-                results = service.users().messages().list(
-                    userId='me',
-                    q=query,
-                    maxResults=500,
-                    pageToken=page_token
-                ).execute()
+        # Il checkpoint va letto PRIMA del listing: un messaggio arrivato
+        # tra listing e lettura del profilo starebbe sotto l'id salvato
+        # senza essere mai stato listato, e i sync successivi lo
+        # salterebbero per sempre. Con l'id letto qui, al peggio il
+        # prossimo giro rilista qualche messaggio già in cache (innocuo:
+        # la cache rende i fetch idempotenti)
+        checkpoint_history_id = None
+        try:
+            profile = service.users().getProfile(userId='me').execute()
+            checkpoint_history_id = profile.get('historyId')
+        except HttpError as e:
+            logger.warning("Impossibile leggere historyId: %s", e)
+
+        all_ids = None
+        from_history = False
+
+        if not is_first_sync and sync_state.get('history_id'):
+            # Sync incrementale: delta lato server via history API.
+            # Restituisce solo i messaggi aggiunti dopo l'ultimo sync invece
+            # di rifiltrare 3 settimane di posta con una query after:
+            try:
+                all_ids = _list_history_message_ids(
+                    service, sync_state['history_id']
+                )
+                from_history = True
+                logger.info("-> SINCRONIZZAZIONE INCREMENTALE via historyId: "
+                            "%d nuovi messaggi", len(all_ids))
+            except HttpError as e:
+                # historyId troppo vecchio (404): fallback sulla query
+                logger.warning("History non disponibile (%s), fallback su query after:",
+                               e.resp.status if e.resp else e)
+
+        if all_ids is None:
+            # Costruisci la query in base al tipo di sincronizzazione
+            if is_first_sync:
+                # Prima sync: tutto l'anno corrente
+                query = f'from:{MEMO_SENDER} after:{anno}/01/01'
+                logger.info("-> PRIMA SINCRONIZZAZIONE: scarico tutto dal 1 gennaio %d", anno)
             else:
-                results = service.users().messages().list(
-                    userId='me',
-                    q=query,
-                    maxResults=500
-                ).execute()
-
-            batch = results.get('messages', [])
-            messages.extend(batch)
-            print(f"    -> {len(batch)} email in questa pagina (totale: {len(messages)})")
-
-            # Controlla se ci sono altre pagine
-            page_token = results.get('nextPageToken')
-            if not page_token:
-                break
-            page_num += 1
-
-        print(f"Trovate {len(messages)} email di notifica totali")
-
-        # Prima passa: raccogli tutte le email
-        all_emails = []
-        for i, msg_info in enumerate(messages):
-            msg_id = msg_info['id']
-            print(f"  [{i+1}/{len(messages)}] Recuperando {msg_id}...")
-
-            msg = service.users().messages().get(
-                userId='me',
-                id=msg_id,
-                format='full'
-            ).execute()
-
-            body = get_email_body(msg)
-            email_date = get_email_date(msg)
-            subject = get_email_subject(msg)
-
-            all_emails.append({
-                'id': msg_id,
-                'body': body,
-                'email_date': email_date,
-                'subject': subject
-            })
+                # Sync successiva: solo ultime 3 settimane
+                three_weeks_ago = (datetime.now() - timedelta(weeks=3)).strftime('%Y/%m/%d')
+                query = f'from:{MEMO_SENDER} after:{three_weeks_ago}'
+                logger.info("-> SINCRONIZZAZIONE INCREMENTALE: ultime 3 settimane (dal %s)", three_weeks_ago)
+
+            all_ids = _list_message_ids(service, query)
+
+        logger.info("Trovate %d email di notifica totali", len(all_ids))
+
+        # Cache persistente: le email già viste in sync precedenti non
+        # vengono più richieste al server (None = classificata "altro")
+        cache = load_email_cache()
+        new_ids = [mid for mid in all_ids if mid not in cache]
+        if len(new_ids) < len(all_ids):
+            logger.info("%d email già in cache, %d da scaricare",
+                        len(all_ids) - len(new_ids), len(new_ids))
+
+        # Diventa False se qualche messaggio non è stato scaricato (errori
+        # per-messaggio nei batch): in quel caso l'historyId non avanza
+        fetch_completo = True
+
+        if new_ids:
+            # Prima passa: solo metadati (Subject/Date), che bastano per
+            # classificare l'email. Le risposte metadata sono molto più
+            # leggere del formato full: per le email "altro" (scartate)
+            # non scarichiamo mai il corpo.
+            logger.info("Recupero metadati di %d email...", len(new_ids))
+            metadata = fetch_metadata_batch(service, new_ids)
+            if len(metadata) < len(new_ids):
+                fetch_completo = False
+
+            keep_ids = []
+            for mid, msg in metadata.items():
+                hdrs = get_email_headers(msg)
+                # La history API non filtra per mittente: verifica qui
+                if from_history and MEMO_SENDER not in hdrs.get('from', ''):
+                    cache[mid] = None
+                    continue
+                if classify_email(get_email_subject(hdrs)) != "altro":
+                    keep_ids.append(mid)
+                else:
+                    cache[mid] = None
+            logger.info("-> %d email rilevanti su %d", len(keep_ids), len(metadata))
+
+            # Seconda passa: formato full solo per le email rilevanti
+            full_messages = fetch_full_batch(service, keep_ids)
+            if len(full_messages) < len(keep_ids):
+                fetch_completo = False
+
+            for mid, msg in full_messages.items():
+                hdrs = get_email_headers(msg)
+                # internalDate (ms dall'epoca) arriva già nel payload:
+                # niente parsing RFC 5322 dell'header Date nel percorso caldo
+                internal_ts = int(msg.get('internalDate', 0))
+                if internal_ts:
+                    email_date = datetime.fromtimestamp(internal_ts / 1000).isoformat()
+                else:
+                    email_date = get_email_date(hdrs)
+                cache[mid] = {
+                    'id': mid,
+                    'body': get_email_body(msg),
+                    'email_date': email_date,
+                    'internal_ts': internal_ts,
+                    'subject': get_email_subject(hdrs)
+                }
+
+            save_email_cache(cache)
+
+        # Processa l'unione di cache + nuove email: il consolidamento di una
+        # giornata ha bisogno di TUTTE le email che la riguardano, non solo
+        # di quelle arrivate dopo l'ultimo sync
+        all_emails = [email for email in cache.values() if email]
 
         # Ordina per data email (dalla più vecchia alla più recente)
         # Così l'ultima email processata sovrascrive le precedenti
-        all_emails.sort(key=lambda x: x['email_date'])
+        all_emails.sort(key=_email_sort_key)
+
+        logger.info("Processando email ordinate per data...")
 
-        print(f"\nProcessando email ordinate per data...")
+        # Parsing su thread pool: il guadagno è limitato, perché il motore
+        # regex di CPython tiene il GIL e il matching domina _parse_one;
+        # si sovrappongono solo la decodifica base64 e lo scheduling.
+        # L'aggregazione resta seriale (in ordine cronologico) per evitare
+        # race su dict/list.
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            parsed = list(executor.map(_parse_one, all_emails))
 
-        # Seconda passa: processa in ordine cronologico
-        for email in all_emails:
-            email_type = classify_email(email['subject'])
+        # La cache è persistente, quindi dopo il cambio anno rigioca anche
+        # le email dell'anno archiviato: i record fuori anno vanno scartati
+        # qui, o rientrerebbero nel file dell'anno corrente a ogni sync
+        prefisso_anno = f"{anno}-"
+
+        for email_type, record in parsed:
+            if record is None:
+                continue
 
             if email_type == "turno":
-                turno = parse_turno_servizio(
-                    email['body'],
-                    email['email_date'],
-                    email['id'],
-                    email['subject']
-                )
-                if turno:
-                    # Aggiungi o aggiorna il turno per quella data/ora
-                    turni_per_data[turno.data].append(turno)
-                    print(f"    -> TURNO: {turno.data} {turno.ora_inizio}-{turno.ora_fine} ({turno.durata_ore}h)")
+                if not record.data.startswith(prefisso_anno):
+                    continue
+                # Aggiungi o aggiorna il turno per quella data/ora
+                turni_per_data[record.data].append(record)
+                logger.debug("-> TURNO: %s %s-%s (%sh)", record.data, record.ora_inizio, record.ora_fine, record.durata_ore)
 
             elif email_type == "eliminazione":
-                elim = parse_eliminazione_turno(
-                    email['body'],
-                    email['email_date'],
-                    email['id'],
-                    email['subject']
-                )
-                if elim:
-                    eliminazioni.append(elim)
-                    print(f"    -> ELIMINAZIONE turno del {elim['data']}")
+                if not record['data'].startswith(prefisso_anno):
+                    continue
+                eliminazioni.append(record)
+                logger.debug("-> ELIMINAZIONE turno del %s", record['data'])
 
             elif email_type == "licenza":
-                lic = parse_licenza(
-                    email['body'],
-                    email['email_date'],
-                    email['id'],
-                    email['subject']
-                )
-                if lic:
-                    licenze.append(lic)
-                    print(f"    -> LICENZA {lic.tipo} - {lic.stato}")
+                # Stesso criterio del merge: la licenza appartiene all'anno
+                # della sua data di inizio
+                if not record.data_inizio.startswith(prefisso_anno):
+                    continue
+                licenze.append(record)
+                logger.debug("-> LICENZA %s - %s", record.tipo, record.stato)
+
+        # Salva il checkpoint letto a inizio sync: il prossimo giro
+        # incrementale riparte da lì invece di rifare la query sulle
+        # ultime 3 settimane. Avanza solo a valle di un sync completo: se
+        # il fetch è fallito (in blocco o per singoli messaggi) l'id resta
+        # quello vecchio e i messaggi persi vengono ritentati
+        if fetch_completo and checkpoint_history_id:
+            sync_state['history_id'] = checkpoint_history_id
+            save_sync_state(sync_state)
 
     except HttpError as e:
-        print(f"Errore API Gmail: {e}")
+        logger.error("Errore API Gmail: %s", e)
 
     return {
         'turni_per_data': turni_per_data,
@@ -794,20 +1105,31 @@ def turni_si_sovrappongono(t1: Turno, t2: Turno) -> bool:
     Due turni si sovrappongono se uno inizia prima che l'altro finisca.
     Turni consecutivi (uno finisce quando l'altro inizia) NON si sovrappongono.
     """
-    # Converti in minuti per facile confronto
-    def to_minutes(time_str):
-        h, m = map(int, time_str.split(':'))
-        return h * 60 + m
+    # Confronto su minuti precalcolati in __post_init__: nessun parsing
+    # di stringhe nel loop di consolidamento.
+    # Separati = uno finisce prima/quando l'altro inizia
+    return not (t1._end_min <= t2._start_min or t2._end_min <= t1._start_min)
 
-    start1 = to_minutes(t1.ora_inizio)
-    end1 = to_minutes(t1.ora_fine)
-    start2 = to_minutes(t2.ora_inizio)
-    end2 = to_minutes(t2.ora_fine)
 
-    # Due turni si sovrappongono se non sono completamente separati
-    # Separati = uno finisce prima/quando l'altro inizia
-    # t1 finisce prima che t2 inizi, o t2 finisce prima che t1 inizi
-    return not (end1 <= start2 or end2 <= start1)
+# Firma esplicita: la compilazione avviene eager all'import (una volta,
+# poi arriva dalla cache su disco) invece che al primo utilizzo
+@njit('int8[:](int64[:], int64[:], int8[:])', cache=True)
+def _consolidate_mask(starts, ends, kept):
+    """Sweep di consolidamento: per ogni turno (in ordine cronologico email)
+    azzera i turni già tenuti che si sovrappongono, poi lo marca come tenuto.
+
+    Lavora solo su array di interi, quindi è compilabile con Numba; senza
+    Numba gira comunque come puro Python.
+    """
+    n = len(starts)
+    for idx in range(n):
+        s = starts[idx]
+        e = ends[idx]
+        for j in range(n):
+            if kept[j] == 1 and not (ends[j] <= s or e <= starts[j]):
+                kept[j] = 0
+        kept[idx] = 1
+    return kept
 
 
 def consolidate_turni(turni_per_data: Dict[str, List[Turno]], eliminazioni: List[Dict]) -> List[Giornata]:
@@ -830,29 +1152,36 @@ def consolidate_turni(turni_per_data: Dict[str, List[Turno]], eliminazioni: List
         eliminazioni_per_data[elim['data']].append(elim)
 
     for data, turni in sorted(turni_per_data.items()):
-        # Ordina turni per data email (dal più vecchio al più recente)
-        turni_ordinati = sorted(turni, key=lambda t: t.email_date)
+        n = len(turni)
+
+        # Layout SoA: i campi caldi dei Turno vengono estratti una volta in
+        # array paralleli (ordinamento cronologico incluso); gli oggetti
+        # Python si toccano di nuovo solo per scrivere lo stato finale
+        if np is not None:
+            email_dates = np.array([t.email_date for t in turni])
+            order = np.argsort(email_dates, kind='stable')
+            turni_ordinati = [turni[i] for i in order]
+            starts = np.fromiter((t._start_min for t in turni_ordinati),
+                                 dtype=np.int64, count=n)
+            ends = np.fromiter((t._end_min for t in turni_ordinati),
+                               dtype=np.int64, count=n)
+            kept = _consolidate_mask(starts, ends, np.zeros(n, dtype=np.int8))
+        else:
+            # Ordina turni per data email (dal più vecchio al più recente)
+            turni_ordinati = sorted(turni, key=lambda t: t.email_date)
+            starts = [t._start_min for t in turni_ordinati]
+            ends = [t._end_min for t in turni_ordinati]
+            kept = _consolidate_mask(starts, ends, [0] * n)
 
         # Lista turni finali per questa giornata
         turni_consolidati: List[Turno] = []
-
-        for nuovo_turno in turni_ordinati:
-            # Controlla se questo turno si sovrappone con turni esistenti
-            turni_da_rimuovere = []
-
-            for i, turno_esistente in enumerate(turni_consolidati):
-                if turni_si_sovrappongono(nuovo_turno, turno_esistente):
-                    # Si sovrappongono: il nuovo (più recente) sostituisce il vecchio
-                    turni_da_rimuovere.append(i)
-
-            # Rimuovi turni sovrapposti (in ordine inverso per non sballare gli indici)
-            for i in reversed(turni_da_rimuovere):
-                rimosso = turni_consolidati.pop(i)
-                rimosso.stato = 'eliminato'
-                print(f"  [SOVRAPP] {data}: {rimosso.ora_inizio}-{rimosso.ora_fine} sostituito da {nuovo_turno.ora_inizio}-{nuovo_turno.ora_fine}")
-
-            # Aggiungi il nuovo turno
-            turni_consolidati.append(nuovo_turno)
+        for idx, turno in enumerate(turni_ordinati):
+            if kept[idx]:
+                turni_consolidati.append(turno)
+            else:
+                # Sovrapposto a un aggiornamento più recente
+                turno.stato = 'eliminato'
+                logger.debug("[SOVRAPP] %s: %s-%s sostituito da un aggiornamento più recente", data, turno.ora_inizio, turno.ora_fine)
 
         # Applica eliminazioni per questa data
         if data in eliminazioni_per_data:
@@ -870,19 +1199,19 @@ def consolidate_turni(turni_per_data: Dict[str, List[Turno]], eliminazioni: List
                         if turno.ora_inizio == ora_elim:
                             if elim['email_date'] > turno.email_date:
                                 turno.stato = 'eliminato'
-                                print(f"  [ELIM] Turno {data} {ora_elim} eliminato")
+                                logger.debug("[ELIM] Turno %s %s eliminato", data, ora_elim)
                     else:
                         # Eliminazione generica: elimina tutti i turni più vecchi
                         if elim['email_date'] > turno.email_date:
                             turno.stato = 'eliminato'
-                            print(f"  [ELIM] Turno {data} {turno.ora_inizio} eliminato (generico)")
+                            logger.debug("[ELIM] Turno %s %s eliminato (generico)", data, turno.ora_inizio)
 
-        # Separa turni attivi
-        turni_attivi = [t for t in turni_consolidati if t.stato == 'attivo']
-
-        # IMPORTANTE: Le ore di ASSENZA non vanno conteggiate!
-        turni_lavorativi = [t for t in turni_attivi if t.tipo != 'ASSENZA']
-        ore_totali = sum(t.durata_ore for t in turni_lavorativi)
+        # Somma le ore dei turni attivi in un unico passaggio
+        # (IMPORTANTE: le ore di ASSENZA non vanno conteggiate!)
+        ore_totali = 0.0
+        for t in turni_consolidati:
+            if t.stato == 'attivo' and t.tipo != 'ASSENZA':
+                ore_totali += t.durata_ore
 
         # Ricalcola straordinario considerando il totale giornaliero
         ore_ordinarie = min(ore_totali, ORE_TURNO_STANDARD)
@@ -897,12 +1226,30 @@ def consolidate_turni(turni_per_data: Dict[str, List[Turno]], eliminazioni: List
         )
         giornate.append(giornata)
 
-    # Ordina per data (più recente prima)
-    giornate.sort(key=lambda g: g.data, reverse=True)
-
     return giornate
 
 
+def _make_absence_turno(turno_id: str, dettaglio: str, data: str,
+                        email_id: str, email_date: str) -> Turno:
+    """Crea un turno fittizio di assenza (riposo o licenza) a ore zero."""
+    return Turno(
+        id=turno_id,
+        tipo="ASSENZA",
+        dettaglio=dettaglio,
+        matricola=EMPLOYEE_ID,
+        data=data,
+        ora_inizio="00:00",
+        ora_fine="23:59",
+        durata_ore=0,
+        is_straordinario=False,
+        ore_ordinarie=0,
+        ore_straordinario=0,
+        email_date=email_date,
+        email_id=email_id,
+        stato="attivo"
+    )
+
+
 def add_missing_rest_days(giornate: List[Giornata], anno: int = 2025) -> List[Giornata]:
     """
     Aggiunge automaticamente i giorni di riposo mancanti:
@@ -913,39 +1260,42 @@ def add_missing_rest_days(giornate: List[Giornata], anno: int = 2025) -> List[Gi
     - Ogni settimana ha diritto a 1 giorno di riposo settimanale
     - Le festività nazionali sono riposi festivi se non lavorati
     """
-    print("\nAggiunta giorni di riposo mancanti...")
+    logger.info("Aggiunta giorni di riposo mancanti...")
 
     # Crea un set delle date già presenti
     date_esistenti = {g.data for g in giornate}
 
-    # Calcola la data di oggi per non aggiungere giorni futuri
-    oggi = datetime.now().strftime('%Y-%m-%d')
+    # Calcola la data di oggi per non aggiungere giorni futuri; il
+    # timestamp dei turni generati è unico per l'intera esecuzione
+    now = datetime.now()
+    oggi = now.strftime('%Y-%m-%d')
+    now_iso = now.isoformat()
+    lower_bound = f"{anno}-01-01"
 
-    # Ottieni festività e domeniche
+    # Ottieni festività e domeniche, prefiltrate sull'intervallo valido
+    # (i limiti sono costanti: inutile ricontrollarli dentro i loop)
     festivi = get_festivi_italiani(anno)
-    domeniche = get_all_sundays(anno)
+    festivi_validi = [
+        (data, nome) for data, nome in festivi.items()
+        if lower_bound <= data <= oggi
+    ]
+    domeniche_valide = [
+        data for data in get_all_sundays(anno)
+        if lower_bound <= data <= oggi and data not in festivi
+    ]
 
     giorni_aggiunti = 0
 
     # 1. Aggiungi festività mancanti come "Riposo Festivo"
-    for data, nome_festivo in festivi.items():
-        if data not in date_esistenti and data <= oggi and data >= f"{anno}-01-01":
+    for data, nome_festivo in festivi_validi:
+        if data not in date_esistenti:
             # Crea turno fittizio per il riposo festivo
-            turno = Turno(
-                id=f"{data}_RF_auto",
-                tipo="ASSENZA",
+            turno = _make_absence_turno(
+                turno_id=f"{data}_RF_auto",
                 dettaglio=f"Riposo festivita' ({nome_festivo})",
-                matricola=EMPLOYEE_ID,
                 data=data,
-                ora_inizio="00:00",
-                ora_fine="23:59",
-                durata_ore=0,
-                is_straordinario=False,
-                ore_ordinarie=0,
-                ore_straordinario=0,
-                email_date=datetime.now().isoformat(),
                 email_id="auto_generated",
-                stato="attivo"
+                email_date=now_iso
             )
 
             giornata = Giornata(
@@ -958,46 +1308,33 @@ def add_missing_rest_days(giornate: List[Giornata], anno: int = 2025) -> List[Gi
             giornate.append(giornata)
             date_esistenti.add(data)
             giorni_aggiunti += 1
-            print(f"  + {data}: Riposo Festivo ({nome_festivo})")
+            logger.debug("+ %s: Riposo Festivo (%s)", data, nome_festivo)
 
     # 2. Aggiungi domeniche mancanti come "Riposo Settimanale"
-    for data in domeniche:
-        if data not in date_esistenti and data <= oggi and data >= f"{anno}-01-01":
-            # Controlla se non è già una festività (già aggiunta sopra)
-            if data not in festivi:
-                turno = Turno(
-                    id=f"{data}_RS_auto",
-                    tipo="ASSENZA",
-                    dettaglio="Riposo settimanale",
-                    matricola=EMPLOYEE_ID,
-                    data=data,
-                    ora_inizio="00:00",
-                    ora_fine="23:59",
-                    durata_ore=0,
-                    is_straordinario=False,
-                    ore_ordinarie=0,
-                    ore_straordinario=0,
-                    email_date=datetime.now().isoformat(),
-                    email_id="auto_generated",
-                    stato="attivo"
-                )
-
-                giornata = Giornata(
-                    data=data,
-                    turni=[turno],
-                    ore_totali=0,
-                    ore_ordinarie=0,
-                    ore_straordinario=0
-                )
-                giornate.append(giornata)
-                date_esistenti.add(data)
-                giorni_aggiunti += 1
-                print(f"  + {data}: Riposo Settimanale")
+    # (le domeniche festive sono già state aggiunte sopra)
+    for data in domeniche_valide:
+        if data not in date_esistenti:
+            turno = _make_absence_turno(
+                turno_id=f"{data}_RS_auto",
+                dettaglio="Riposo settimanale",
+                data=data,
+                email_id="auto_generated",
+                email_date=now_iso
+            )
 
-    # Riordina per data
-    giornate.sort(key=lambda g: g.data, reverse=True)
+            giornata = Giornata(
+                data=data,
+                turni=[turno],
+                ore_totali=0,
+                ore_ordinarie=0,
+                ore_straordinario=0
+            )
+            giornate.append(giornata)
+            date_esistenti.add(data)
+            giorni_aggiunti += 1
+            logger.debug("+ %s: Riposo Settimanale", data)
 
-    print(f"  -> Aggiunti {giorni_aggiunti} giorni di riposo")
+    logger.info("-> Aggiunti %d giorni di riposo", giorni_aggiunti)
 
     return giornate
 
@@ -1007,11 +1344,14 @@ def expand_licenses_to_giornate(giornate: List[Giornata], licenze: List[Licenza]
     Espande le licenze approvate in giornate.
     Per ogni licenza approvata, crea una giornata per ogni giorno del periodo.
     """
-    print("\nEspansione licenze approvate in giornate...")
+    logger.info("Espansione licenze approvate in giornate...")
 
     # Set delle date già esistenti
     date_esistenti = set(g.data for g in giornate)
 
+    # Timestamp unico per tutti i turni generati in questa esecuzione
+    now_iso = datetime.now().isoformat()
+
     # Filtra solo licenze approvate (stato finale)
     licenze_approvate = [l for l in licenze if l.stato == 'Approvata']
 
@@ -1024,49 +1364,41 @@ def expand_licenses_to_giornate(giornate: List[Giornata], licenze: List[Licenza]
     giorni_aggiunti = 0
 
     for lic in licenze_uniche.values():
-        # Parse date
+        # Parse date: lavoriamo sugli ordinali, così il range di giorni è un
+        # semplice range() e ogni data si riottiene con fromordinal/isoformat
         try:
-            data_inizio = datetime.strptime(lic.data_inizio, '%Y-%m-%d')
-            data_fine = datetime.strptime(lic.data_fine, '%Y-%m-%d')
+            inizio_ord = date.fromisoformat(lic.data_inizio).toordinal()
+            fine_ord = date.fromisoformat(lic.data_fine).toordinal()
         except:
-            print(f"  [SKIP] Date non valide: {lic.data_inizio} - {lic.data_fine}")
+            logger.debug("[SKIP] Date non valide: %s - %s", lic.data_inizio, lic.data_fine)
             continue
 
+        # Determina il dettaglio in base al tipo di licenza
+        # (costante per tutta la licenza, non va ricalcolato per giorno)
+        tipo_licenza = lic.tipo or 'ordinaria'
+        if tipo_licenza == 'ordinaria':
+            dettaglio = 'Licenza ordinaria'
+        elif tipo_licenza == 'straordinaria':
+            dettaglio = 'Licenza straordinaria'
+        elif tipo_licenza == 'speciale':
+            dettaglio = 'Licenza speciale'
+        elif tipo_licenza == 'riposo_donatori':
+            dettaglio = 'Riposo donatore sangue'
+        else:
+            dettaglio = f'Licenza {tipo_licenza}'
+
         # Genera ogni giorno nel range
-        current = data_inizio
-        while current <= data_fine:
-            data_str = current.strftime('%Y-%m-%d')
+        for giorno_ord in range(inizio_ord, fine_ord + 1):
+            data_str = date.fromordinal(giorno_ord).isoformat()
 
             # Solo se non esiste già una giornata
             if data_str not in date_esistenti:
-                # Determina il dettaglio in base al tipo di licenza
-                tipo_licenza = lic.tipo or 'ordinaria'
-                if tipo_licenza == 'ordinaria':
-                    dettaglio = 'Licenza ordinaria'
-                elif tipo_licenza == 'straordinaria':
-                    dettaglio = 'Licenza straordinaria'
-                elif tipo_licenza == 'speciale':
-                    dettaglio = 'Licenza speciale'
-                elif tipo_licenza == 'riposo_donatori':
-                    dettaglio = 'Riposo donatore sangue'
-                else:
-                    dettaglio = f'Licenza {tipo_licenza}'
-
-                turno = Turno(
-                    id=f"lic_{data_str}_{tipo_licenza}",
-                    tipo='ASSENZA',
+                turno = _make_absence_turno(
+                    turno_id=f"lic_{data_str}_{tipo_licenza}",
                     dettaglio=dettaglio,
-                    matricola=EMPLOYEE_ID,
                     data=data_str,
-                    ora_inizio='00:00',
-                    ora_fine='23:59',
-                    durata_ore=0,
-                    is_straordinario=False,
-                    ore_ordinarie=0,
-                    ore_straordinario=0,
-                    email_date=datetime.now().isoformat(),
                     email_id=f'licenza_{tipo_licenza}',
-                    stato='attivo'
+                    email_date=now_iso
                 )
 
                 giornata = Giornata(
@@ -1082,20 +1414,17 @@ def expand_licenses_to_giornate(giornate: List[Giornata], licenze: List[Licenza]
                 date_esistenti.add(data_str)
                 giorni_aggiunti += 1
 
-            current += timedelta(days=1)
-
-    # Riordina per data
-    giornate.sort(key=lambda g: g.data, reverse=True)
-
-    print(f"  -> Aggiunti {giorni_aggiunti} giorni di licenza")
+    logger.info("-> Aggiunti %d giorni di licenza", giorni_aggiunti)
 
     return giornate
 
 
-def get_festivita_italiane(anno: int) -> set:
+@lru_cache(maxsize=16)
+def get_festivita_italiane(anno: int) -> frozenset:
     """
     Restituisce le festività italiane per l'anno specificato.
     Include festività fisse + Pasqua e Lunedì dell'Angelo.
+    Il risultato è memoizzato: il set viene costruito una volta per anno.
     """
     # Festività fisse
     festivita = {
@@ -1133,29 +1462,85 @@ def get_festivita_italiane(anno: int) -> set:
     festivita.add(pasqua.strftime("%Y-%m-%d"))
     festivita.add(lunedi_angelo.strftime("%Y-%m-%d"))
 
-    return festivita
+    return frozenset(festivita)
 
 
+@lru_cache(maxsize=4096)
 def is_giorno_festivo(data_str: str) -> bool:
     """
     Verifica se una data è un giorno festivo (domenica o festività nazionale).
+    Memoizzata: le stesse date ricorrono molte volte tra statistiche e merge.
     """
     try:
-        data = datetime.strptime(data_str, "%Y-%m-%d").date()
-        anno = data.year
-
-        # Domenica = 6
-        if data.weekday() == 6:
+        anno = int(data_str[:4])
+        mese = int(data_str[5:7])
+        giorno = int(data_str[8:10])
+
+        # Valida la data come faceva strptime: senza questo controllo
+        # Zeller calcolerebbe un giorno della settimana anche per date
+        # inesistenti tipo 2025-02-30 (che deve restituire False)
+        date(anno, mese, giorno)
+
+        # Giorno della settimana con la congruenza di Zeller (h=1 -> domenica),
+        # molto più economica di strptime
+        z_mese, z_anno = (mese + 12, anno - 1) if mese < 3 else (mese, anno)
+        k = z_anno % 100
+        j = z_anno // 100
+        h = (giorno + (13 * (z_mese + 1)) // 5 + k + k // 4 + j // 4 + 5 * j) % 7
+        if h == 1:
             return True
 
         # Festività nazionali
-        festivita = get_festivita_italiane(anno)
-        return data_str in festivita
+        return data_str in get_festivita_italiane(anno)
 
     except:
         return False
 
 
+@njit('int64(int64, int64, int64, int64)', cache=True)
+def _overlap(a_start: int, a_end: int, b_start: int, b_end: int) -> int:
+    """Lunghezza dell'intersezione tra gli intervalli [a_start,a_end) e [b_start,b_end)."""
+    return max(0, min(a_end, b_end) - max(a_start, b_start))
+
+
+# Firma eager come per _consolidate_mask: i segmenti arrivano in due
+# array int64 paralleli, un tipo stabile tra le versioni di Numba (le
+# liste di tuple riflesse sono deprecate e in via di rimozione)
+@njit('UniTuple(int64, 2)(int64[:], int64[:], int64)', cache=True)
+def _straordinario_breakdown(starts, ends, ordinarie_min):
+    """
+    Minuti di straordinario (diurni, notturni) oltre i primi ordinarie_min
+    minuti lavorati. starts/ends sono i segmenti (inizio, fine) in minuti,
+    già ordinati cronologicamente, con fine oltre 1440 per i turni che
+    attraversano la mezzanotte. Solo aritmetica su interi: nessun accesso
+    a oggetti, così il kernel resta compilabile/compatto.
+    """
+    straord_min_diurno = 0
+    straord_min_notturno = 0
+    cum = 0
+
+    for i in range(len(starts)):
+        start = starts[i]
+        end = ends[i]
+        length = end - start
+        if cum + length <= ordinarie_min:
+            cum += length
+            continue
+        if cum < ordinarie_min:
+            # Il limite delle ore ordinarie cade dentro questo segmento
+            start += ordinarie_min - cum
+        cum += length
+
+        diurno = (
+            _overlap(start, end, DIURNO_START, DIURNO_END)
+            + _overlap(start, end, DIURNO_START + 1440, DIURNO_END + 1440)
+        )
+        straord_min_diurno += diurno
+        straord_min_notturno += (end - start) - diurno
+
+    return straord_min_diurno, straord_min_notturno
+
+
 def calcola_ore_per_fascia(ora_inizio: str, ora_fine: str, ore_straordinario: float, is_festivo: bool) -> dict:
     """
     Calcola le ore di straordinario suddivise per fascia oraria.
@@ -1181,31 +1566,27 @@ def calcola_ore_per_fascia(ora_inizio: str, ora_fine: str, ore_straordinario: fl
         return result
 
     try:
-        def to_minutes(time_str):
-            h, m = map(int, time_str.split(':'))
-            return h * 60 + m
-
-        start = to_minutes(ora_inizio)
-        end = to_minutes(ora_fine)
+        # Conversione che solleva sugli orari malformati: _time_to_minutes
+        # ritornerebbe 0, cioè un inizio fittizio a mezzanotte e un riparto
+        # diurno/notturno senza senso. Un orario invalido deve invece
+        # prendere il ramo di fallback (tutto diurno) qui sotto
+        h, m = ora_inizio.split(':')
+        start = int(h) * 60 + int(m)
+        h, m = ora_fine.split(':')
+        end = int(h) * 60 + int(m)
 
         # Se il turno attraversa la mezzanotte
         if end <= start:
             end += 24 * 60
 
-        # Limiti fasce in minuti
-        DIURNO_START = 6 * 60   # 06:00
-        DIURNO_END = 22 * 60    # 22:00
-
-        # Calcola minuti diurni e notturni del turno totale
-        minuti_diurni = 0
-        minuti_notturni = 0
-
-        for minuto in range(start, end):
-            minuto_normalizzato = minuto % (24 * 60)
-            if DIURNO_START <= minuto_normalizzato < DIURNO_END:
-                minuti_diurni += 1
-            else:
-                minuti_notturni += 1
+        # Intersezione di intervalli in forma chiusa invece del loop
+        # minuto-per-minuto: la finestra diurna va considerata anche
+        # traslata di +24h per i turni che attraversano la mezzanotte
+        minuti_diurni = (
+            _overlap(start, end, DIURNO_START, DIURNO_END)
+            + _overlap(start, end, DIURNO_START + 1440, DIURNO_END + 1440)
+        )
+        minuti_notturni = (end - start) - minuti_diurni
 
         # Calcola la proporzione di ore diurne/notturne
         totale_minuti = minuti_diurni + minuti_notturni
@@ -1233,6 +1614,28 @@ def calcola_ore_per_fascia(ora_inizio: str, ora_fine: str, ore_straordinario: fl
     return result
 
 
+def _nuova_riga_tipo() -> Dict:
+    """Riga vuota dell'aggregato per tipo di servizio."""
+    return {'count': 0, 'ore': 0}
+
+
+def _nuova_riga_mese() -> Dict:
+    """Riga vuota dell'aggregato mensile."""
+    return {
+        'giorni': 0, 'ore': 0, 'ore_ordinarie': 0, 'ore_straordinario': 0,
+        'turnazioni_esterne': 0,
+        'straord_diurno': 0, 'straord_notturno': 0,
+        'straord_festivo_diurno': 0, 'straord_festivo_notturno': 0,
+        'recuperi_mese': 0,  # Recupero ore prestate nel mese in corso
+        'recuperi_non_retribuiti': 0  # Recupero ore non retribuite
+    }
+
+
+def _conta_stati() -> defaultdict:
+    """Contatore per stato delle licenze."""
+    return defaultdict(int)
+
+
 def calculate_stats(giornate: List[Giornata], licenze: List[Licenza]) -> Dict:
     """Calcola statistiche complete."""
     if not giornate:
@@ -1247,34 +1650,21 @@ def calculate_stats(giornate: List[Giornata], licenze: List[Licenza]) -> Dict:
             'licenze_per_tipo': {}
         }
 
-    # Statistiche base
-    ore_totali = sum(g.ore_totali for g in giornate)
-    ore_ordinarie = sum(g.ore_ordinarie for g in giornate)
-    ore_straordinario = sum(g.ore_straordinario for g in giornate)
-    giorni_lavorati = len([g for g in giornate if g.ore_totali > 0])
+    # Tutte le statistiche (totali, per tipo, per mese) vengono accumulate
+    # in un UNICO passaggio sulle giornate, invece di 4 sum() + 2 loop
+    ore_totali = 0.0
+    ore_ordinarie = 0.0
+    ore_straordinario = 0.0
+    giorni_lavorati = 0
 
     # Per tipo di servizio (ASSENZA tracciata separatamente, senza ore)
-    per_tipo = defaultdict(lambda: {'count': 0, 'ore': 0})
+    per_tipo = defaultdict(_nuova_riga_tipo)
     assenze_count = 0
-    for g in giornate:
-        for t in g.turni:
-            if t.stato == 'attivo':
-                per_tipo[t.tipo]['count'] += 1
-                # Le ore di ASSENZA non vanno conteggiate
-                if t.tipo != 'ASSENZA':
-                    per_tipo[t.tipo]['ore'] += t.durata_ore
-                else:
-                    assenze_count += 1
 
-    # Per mese (incluse turnazioni esterne e breakdown straordinario)
-    per_mese = defaultdict(lambda: {
-        'giorni': 0, 'ore': 0, 'ore_ordinarie': 0, 'ore_straordinario': 0,
-        'turnazioni_esterne': 0,
-        'straord_diurno': 0, 'straord_notturno': 0,
-        'straord_festivo_diurno': 0, 'straord_festivo_notturno': 0,
-        'recuperi_mese': 0,  # Recupero ore prestate nel mese in corso
-        'recuperi_non_retribuiti': 0  # Recupero ore non retribuite
-    })
+    # Per mese (incluse turnazioni esterne e breakdown straordinario);
+    # le righe vengono create pigramente dal defaultdict solo quando il
+    # mese ha davvero qualcosa da registrare (mai su semplici letture)
+    per_mese = defaultdict(_nuova_riga_mese)
     turnazioni_esterne_totali = 0
 
     # Totali recuperi
@@ -1288,109 +1678,123 @@ def calculate_stats(giornate: List[Giornata], licenze: List[Licenza]) -> Dict:
     totale_straord_festivo_notturno = 0
 
     for g in giornate:
-        mese = g.data[:7]
-
-        # Conta recuperi (anche per giornate senza ore lavorate)
+        # Campi della giornata letti una volta sola: servono sia ai
+        # totali sia alla riga mensile
+        g_ore_totali = g.ore_totali
+        g_ore_ordinarie = g.ore_ordinarie
+        g_ore_straordinario = g.ore_straordinario
+        ore_totali += g_ore_totali
+        ore_ordinarie += g_ore_ordinarie
+        ore_straordinario += g_ore_straordinario
+
+        mese = g._mese
+        riga_mese = per_mese.get(mese)
+
+        # Un solo passaggio sui turni: conteggio per tipo, assenze,
+        # recuperi (anche per giornate senza ore lavorate) e lista attivi
+        turni_attivi = []
         for t in g.turni:
-            if t.stato == 'attivo' and t.tipo == 'ASSENZA':
-                dettaglio_lower = t.dettaglio.lower()
-                if 'recupero di ore prestate nel mese' in dettaglio_lower:
+            if t.stato != 'attivo':
+                continue
+            turni_attivi.append(t)
+
+            tipo = t.tipo
+            riga_tipo = per_tipo[tipo]
+            riga_tipo['count'] += 1
+            # Le ore di ASSENZA non vanno conteggiate
+            if tipo != 'ASSENZA':
+                riga_tipo['ore'] += t.durata_ore
+            else:
+                assenze_count += 1
+                if t._recupero_kind == 1:
                     # Recupero ore del mese in corso: -6h dal monte ore mensile
-                    per_mese[mese]['recuperi_mese'] += 1
+                    if riga_mese is None:
+                        riga_mese = per_mese[mese]
+                    riga_mese['recuperi_mese'] += 1
                     totale_recuperi_mese += 1
-                elif 'recupero di ore non retribuite' in dettaglio_lower:
+                elif t._recupero_kind == 2:
                     # Recupero ore non retribuite: -6h dal monte ore accumulato
-                    per_mese[mese]['recuperi_non_retribuiti'] += 1
+                    if riga_mese is None:
+                        riga_mese = per_mese[mese]
+                    riga_mese['recuperi_non_retribuiti'] += 1
                     totale_recuperi_non_retribuiti += 1
 
-        if g.ore_totali > 0:
-            per_mese[mese]['giorni'] += 1
-            per_mese[mese]['ore'] += g.ore_totali
-            per_mese[mese]['ore_ordinarie'] += g.ore_ordinarie
-            per_mese[mese]['ore_straordinario'] += g.ore_straordinario
+        if g_ore_totali > 0:
+            giorni_lavorati += 1
+            if riga_mese is None:
+                riga_mese = per_mese[mese]
+            riga_mese['giorni'] += 1
+            riga_mese['ore'] += g_ore_totali
+            riga_mese['ore_ordinarie'] += g_ore_ordinarie
+            riga_mese['ore_straordinario'] += g_ore_straordinario
 
             # Verifica se è giorno festivo
             is_festivo = is_giorno_festivo(g.data)
 
-            # Conta turnazioni esterne e calcola breakdown straordinario
-            turni_attivi = [t for t in g.turni if t.stato == 'attivo']
             # Considera come turno esterno se ha dettaglio specifico o è un servizio di presenza
-            has_turno_esterno = any(
-                'scorta' in t.dettaglio.lower() or
-                'esterno' in t.dettaglio.lower() or
-                'accompagn' in t.dettaglio.lower()
-                for t in turni_attivi
-            )
+            has_turno_esterno = any(t._is_esterno for t in turni_attivi)
 
             if has_turno_esterno:
-                if g.ore_totali > 12:
-                    per_mese[mese]['turnazioni_esterne'] += 2
+                if g_ore_totali > 12:
+                    riga_mese['turnazioni_esterne'] += 2
                     turnazioni_esterne_totali += 2
                 else:
-                    per_mese[mese]['turnazioni_esterne'] += 1
+                    riga_mese['turnazioni_esterne'] += 1
                     turnazioni_esterne_totali += 1
 
             # Calcola breakdown straordinario per la giornata
             # Lo straordinario sono le ore OLTRE le prime 6 ordinarie
             # Quindi sono le ULTIME ore della giornata lavorativa
-            if g.ore_straordinario > 0:
-                # Raccogli tutti i minuti lavorati ordinati cronologicamente
-                minuti_lavorati = []
-
-                def to_minutes(time_str):
-                    h, m = map(int, time_str.split(':'))
-                    return h * 60 + m
-
-                DIURNO_START = 6 * 60   # 06:00
-                DIURNO_END = 22 * 60    # 22:00
+            if g_ore_straordinario > 0:
+                ordinarie_min = int(ORE_TURNO_STANDARD * 60)
 
+                # Segmenti (inizio, fine) in minuti, ordinati cronologicamente;
+                # i turni oltre la mezzanotte proseguono oltre 1440. Gli orari
+                # arrivano già convertiti in interi da Turno.__post_init__
+                segs = []
                 for t in turni_attivi:
-                    try:
-                        start = to_minutes(t.ora_inizio)
-                        end = to_minutes(t.ora_fine)
-                        if end <= start:
-                            end += 24 * 60
-
-                        for minuto in range(start, end):
-                            minuti_lavorati.append(minuto)
-                    except:
-                        pass
-
-                # Ordina i minuti cronologicamente
-                minuti_lavorati.sort()
-
-                # Le prime 360 minuti (6h) sono ordinarie
-                # I minuti oltre sono straordinario
-                minuti_straordinario = minuti_lavorati[360:] if len(minuti_lavorati) > 360 else []
-
-                # Conta minuti straordinario diurni e notturni
-                straord_min_diurno = 0
-                straord_min_notturno = 0
-
-                for minuto in minuti_straordinario:
-                    minuto_norm = minuto % (24 * 60)
-                    if DIURNO_START <= minuto_norm < DIURNO_END:
-                        straord_min_diurno += 1
-                    else:
-                        straord_min_notturno += 1
+                    start = t._start_min
+                    end = t._end_min
+                    if end <= start:
+                        end += 24 * 60
+                    segs.append((start, end))
+                segs.sort()
+
+                # Il kernel vuole i segmenti in due array int64 paralleli
+                # (stesso layout SoA di _consolidate_mask); senza NumPy le
+                # liste indicizzate funzionano uguali in puro Python
+                n_segs = len(segs)
+                if np is not None:
+                    seg_starts = np.fromiter((s for s, _ in segs),
+                                             dtype=np.int64, count=n_segs)
+                    seg_ends = np.fromiter((e for _, e in segs),
+                                           dtype=np.int64, count=n_segs)
+                else:
+                    seg_starts = [s for s, _ in segs]
+                    seg_ends = [e for _, e in segs]
+
+                # I primi ordinarie_min minuti sono ordinari: il resto è
+                # straordinario, ripartito per fascia dal kernel numerico
+                straord_min_diurno, straord_min_notturno = \
+                    _straordinario_breakdown(seg_starts, seg_ends, ordinarie_min)
 
                 # Converti in ore e arrotonda a 0.5h
                 straord_diurno = round(straord_min_diurno / 60 * 2) / 2
                 straord_notturno = round(straord_min_notturno / 60 * 2) / 2
 
                 if is_festivo:
-                    per_mese[mese]['straord_festivo_diurno'] += straord_diurno
-                    per_mese[mese]['straord_festivo_notturno'] += straord_notturno
+                    riga_mese['straord_festivo_diurno'] += straord_diurno
+                    riga_mese['straord_festivo_notturno'] += straord_notturno
                     totale_straord_festivo_diurno += straord_diurno
                     totale_straord_festivo_notturno += straord_notturno
                 else:
-                    per_mese[mese]['straord_diurno'] += straord_diurno
-                    per_mese[mese]['straord_notturno'] += straord_notturno
+                    riga_mese['straord_diurno'] += straord_diurno
+                    riga_mese['straord_notturno'] += straord_notturno
                     totale_straord_diurno += straord_diurno
                     totale_straord_notturno += straord_notturno
 
     # Licenze per tipo e stato
-    licenze_per_tipo = defaultdict(lambda: defaultdict(int))
+    licenze_per_tipo = defaultdict(_conta_stati)
     for lic in licenze:
         licenze_per_tipo[lic.tipo][lic.stato] += 1
 
@@ -1421,33 +1825,57 @@ def save_data(giornate: List[Giornata], licenze: List[Licenza], stats: Dict, ann
         anno = datetime.now().year
 
     # Lista archivi disponibili
-    archives = []
-    data_dir = BASE_DIR / 'data'
-    for f in data_dir.glob('archivio_*.json'):
-        try:
-            arch_anno = int(f.stem.replace('archivio_', ''))
-            archives.append(arch_anno)
-        except:
-            pass
+    archives = _list_archive_years()
+
+    # Serializzazione a blocchi: l'intestazione, poi un record alla volta.
+    # Niente mega-dict con tutte le liste già convertite in memoria: il
+    # picco di RAM resta quello di un singolo record. Output compatto
+    # (python -m json.tool se serve leggerlo a mano)
+    if orjson is not None:
+        # orjson produce bytes: scrittura binaria diretta
+        _dumps = orjson.dumps
+    else:
+        def _dumps(obj):
+            return json.dumps(obj, ensure_ascii=False,
+                              separators=(',', ':')).encode('utf-8')
 
-    output = {
+    header = {
         'anno': anno,
         'last_update': datetime.now().isoformat(),
         'total_giorni': len(giornate),
         'total_licenze': len(licenze),
-        'archives': sorted(archives),
+        'archives': archives,
         'stats': stats,
-        'giornate': [g.to_dict() for g in giornate],
-        'licenze': [l.to_dict() for l in licenze],
-        # Mantieni anche il formato "servizi" per compatibilità con la dashboard
-        'servizi': []
     }
 
-    # Converti giornate in formato servizi per la dashboard esistente
-    for g in giornate:
-        for t in g.turni:
-            if t.stato == 'attivo':
-                output['servizi'].append({
+    DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(DATA_FILE, 'wb') as f:
+        # Intestazione senza la graffa di chiusura: le liste seguono
+        f.write(_dumps(header)[:-1])
+
+        f.write(b',"giornate":[')
+        for i, g in enumerate(giornate):
+            if i:
+                f.write(b',')
+            f.write(_dumps(g.to_dict()))
+
+        f.write(b'],"licenze":[')
+        for i, l in enumerate(licenze):
+            if i:
+                f.write(b',')
+            f.write(_dumps(l.to_dict()))
+
+        # Formato "servizi" per la dashboard esistente (mantenuto per
+        # compatibilità), generato al volo turno per turno
+        f.write(b'],"servizi":[')
+        total_servizi = 0
+        for g in giornate:
+            for t in g.turni:
+                if t.stato != 'attivo':
+                    continue
+                if total_servizi:
+                    f.write(b',')
+                f.write(_dumps({
                     'id': t.id,
                     'tipo_servizio': t.tipo,
                     'dettaglio': sanitize_dettaglio(t.dettaglio),
@@ -1460,68 +1888,73 @@ def save_data(giornate: List[Giornata], licenze: List[Licenza], stats: Dict, ann
                     'ore_ordinarie': t.ore_ordinarie,
                     'ore_straordinario': t.ore_straordinario,
                     'email_date': t.email_date
-                })
-
-    output['total_servizi'] = len(output['servizi'])
-
-    DATA_FILE.parent.mkdir(parents=True, exist_ok=True)
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
-
-    # Copia anche gli archivi nella cartella docs per la dashboard
+                }))
+                total_servizi += 1
+
+        f.write(b'],"total_servizi":%d}' % total_servizi)
+
+    # Copia anche gli archivi nella cartella docs per la dashboard.
+    # Gli archivi cambiano di rado: se la copia è già aggiornata (mtime)
+    # non si tocca nulla, altrimenti si prova un hardlink (zero byte
+    # copiati). Il fallback usa copyfile (zero-copy kernel-side su Linux,
+    # senza il copymode extra di shutil.copy) e allinea l'mtime alla
+    # sorgente così il confronto della prossima esecuzione resta valido
+    import shutil
     docs_dir = BASE_DIR / 'docs'
-    for arch_file in data_dir.glob('archivio_*.json'):
-        import shutil
+    for arch_anno in archives:
+        arch_file = get_archive_file(arch_anno)
         dest = docs_dir / arch_file.name
-        shutil.copy(arch_file, dest)
+        src_stat = arch_file.stat()
+        try:
+            if dest.stat().st_mtime >= src_stat.st_mtime:
+                continue
+        except OSError:
+            pass
+        try:
+            dest.unlink(missing_ok=True)
+            os.link(arch_file, dest)
+        except OSError:
+            shutil.copyfile(arch_file, dest)
+            os.utime(dest, (src_stat.st_atime, src_stat.st_mtime))
 
-    print(f"\nDati salvati in {DATA_FILE}")
+    logger.info("Dati salvati in %s", DATA_FILE)
     if archives:
-        print(f"Archivi disponibili: {archives}")
-    return output
+        logger.info("Archivi disponibili: %s", archives)
 
 
-def merge_with_existing(existing_data: Dict, new_giornate: List[Giornata], new_licenze: List[Licenza]) -> tuple:
+def merge_with_existing(existing_data: Dict, new_giornate: List[Giornata],
+                        new_licenze: List[Licenza], anno: int = None) -> tuple:
     """
     Unisce i dati esistenti con i nuovi.
     Per le ultime 3 settimane, i nuovi dati sovrascrivono.
     Per i dati più vecchi, mantiene quelli esistenti.
+    Con anno, i record esistenti fuori anno vengono scartati durante la
+    stessa passata che fa il dedupe: niente lista filtrata intermedia.
     """
-    # Crea un dizionario delle giornate esistenti
+    prefisso = f"{anno}-" if anno is not None else None
+    # I nuovi oggetti Giornata/Licenza restano tali e quali: la
+    # riconversione dict -> dataclass serve solo ai record esistenti che
+    # sopravvivono al merge (quelli non sovrascritti dai nuovi dati)
+    new_dates = {g.data for g in new_giornate}
+    new_licenze_keys = {f"{lic.id}_{lic.stato}" for lic in new_licenze}
+
+    # Dedup dei record esistenti sulla stessa chiave (l'ultimo vince),
+    # scartando nella stessa passata quelli fuori anno
     existing_giornate_dict = {}
-    if 'giornate' in existing_data:
-        for g_data in existing_data['giornate']:
+    for g_data in existing_data.get('giornate', []):
+        if prefisso is None or g_data['data'].startswith(prefisso):
             existing_giornate_dict[g_data['data']] = g_data
 
-    # Crea un dizionario delle licenze esistenti
     existing_licenze_dict = {}
-    if 'licenze' in existing_data:
-        for l_data in existing_data['licenze']:
-            key = f"{l_data['id']}_{l_data['stato']}"
-            existing_licenze_dict[key] = l_data
+    for l_data in existing_data.get('licenze', []):
+        if prefisso is None or l_data.get('data_inizio', '').startswith(prefisso):
+            existing_licenze_dict[f"{l_data['id']}_{l_data['stato']}"] = l_data
 
-    # Calcola la data limite (3 settimane fa)
-    three_weeks_ago = (datetime.now() - timedelta(weeks=3)).strftime('%Y-%m-%d')
-
-    # Aggiorna con i nuovi dati (ultime 3 settimane)
-    for g in new_giornate:
-        existing_giornate_dict[g.data] = g.to_dict()
-
-    # Aggiorna licenze
-    for lic in new_licenze:
-        key = f"{lic.id}_{lic.stato}"
-        existing_licenze_dict[key] = lic.to_dict()
-
-    # Riconverti in liste
-    merged_giornate_data = list(existing_giornate_dict.values())
-    merged_licenze_data = list(existing_licenze_dict.values())
-
-    # Ordina giornate per data (più recente prima)
-    merged_giornate_data.sort(key=lambda x: x['data'], reverse=True)
-
-    # Riconverti in oggetti Giornata
+    # Riconverti in oggetti solo le giornate esistenti sopravvissute
     merged_giornate = []
-    for g_data in merged_giornate_data:
+    for data, g_data in existing_giornate_dict.items():
+        if data in new_dates:
+            continue
         turni = []
         for t_data in g_data.get('turni', []):
             # Aggiungi matricola di default se mancante (rimossa per privacy)
@@ -1529,7 +1962,7 @@ def merge_with_existing(existing_data: Dict, new_giornate: List[Giornata], new_l
                 t_data['matricola'] = EMPLOYEE_ID
             turni.append(Turno(**t_data))
         giornata = Giornata(
-            data=g_data['data'],
+            data=data,
             turni=turni,
             ore_totali=g_data.get('ore_totali', 0),
             ore_ordinarie=g_data.get('ore_ordinarie', 0),
@@ -1538,13 +1971,17 @@ def merge_with_existing(existing_data: Dict, new_giornate: List[Giornata], new_l
             tipo_licenza=g_data.get('tipo_licenza', '')
         )
         merged_giornate.append(giornata)
+    merged_giornate.extend(new_giornate)
 
-    # Riconverti licenze
-    merged_licenze = []
-    for l_data in merged_licenze_data:
-        merged_licenze.append(Licenza(**l_data))
+    # Stesso schema per le licenze
+    merged_licenze = [
+        Licenza(**l_data)
+        for key, l_data in existing_licenze_dict.items()
+        if key not in new_licenze_keys
+    ]
+    merged_licenze.extend(new_licenze)
 
-    print(f"  -> Dati uniti: {len(merged_giornate)} giornate, {len(merged_licenze)} licenze")
+    logger.info("-> Dati uniti: %d giornate, %d licenze", len(merged_giornate), len(merged_licenze))
 
     return merged_giornate, merged_licenze
 
@@ -1554,6 +1991,42 @@ def get_archive_file(anno: int) -> Path:
     return BASE_DIR / 'data' / f'archivio_{anno}.json'
 
 
+# Cache della scansione archivi, invalidata dall'mtime della directory:
+# finché nessun file viene aggiunto/rimosso la lista non cambia
+_ARCHIVES_CACHE: Dict[str, Any] = {}
+
+
+def _list_archive_years() -> List[int]:
+    """
+    Anni per cui esiste un file archivio_<anno>.json in data/.
+    Usa os.scandir invece di glob: niente pattern matching, una sola
+    lettura di directory condivisa da tutti i punti che la richiedono.
+    Il risultato è memoizzato sull'mtime della directory.
+    """
+    data_dir = BASE_DIR / 'data'
+    try:
+        dir_mtime = os.stat(data_dir).st_mtime_ns
+    except FileNotFoundError:
+        return []
+
+    if _ARCHIVES_CACHE.get('mtime_ns') == dir_mtime:
+        return _ARCHIVES_CACHE['anni']
+
+    anni = []
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            name = entry.name
+            if name.startswith('archivio_') and name.endswith('.json'):
+                try:
+                    anni.append(int(name[len('archivio_'):-len('.json')]))
+                except ValueError:
+                    pass
+    anni.sort()
+    _ARCHIVES_CACHE['mtime_ns'] = dir_mtime
+    _ARCHIVES_CACHE['anni'] = anni
+    return anni
+
+
 def archive_year(anno: int):
     """
     Archivia i dati di un anno specifico.
@@ -1561,7 +2034,7 @@ def archive_year(anno: int):
     """
     existing_data = load_existing_data()
     if not existing_data:
-        print(f"[WARN] Nessun dato da archiviare")
+        logger.warning("Nessun dato da archiviare")
         return
 
     # Filtra giornate dell'anno da archiviare
@@ -1572,7 +2045,7 @@ def archive_year(anno: int):
                     if l.get('data_inizio', '').startswith(anno_str)]
 
     if not giornate_anno:
-        print(f"[WARN] Nessuna giornata trovata per l'anno {anno}")
+        logger.warning("Nessuna giornata trovata per l'anno %d", anno)
         return
 
     # Calcola statistiche per l'anno
@@ -1591,6 +2064,12 @@ def archive_year(anno: int):
             ore_straordinario=g_data.get('ore_straordinario', 0)
         ))
     licenze_obj = [Licenza(**l) for l in licenze_anno]
+
+    # Pre-carica le festività dell'anno (e del successivo, per i turni a
+    # cavallo di Capodanno): i check per-giornata trovano la cache calda
+    get_festivita_italiane(anno)
+    get_festivita_italiane(anno + 1)
+
     stats_anno = calculate_stats(giornate_obj, licenze_obj)
 
     # Salva archivio
@@ -1608,8 +2087,8 @@ def archive_year(anno: int):
     with open(archive_file, 'w', encoding='utf-8') as f:
         json.dump(archivio, f, ensure_ascii=False, indent=2)
 
-    print(f"[OK] Anno {anno} archiviato in {archive_file}")
-    print(f"     {len(giornate_anno)} giornate, {len(licenze_anno)} licenze")
+    logger.info("Anno %d archiviato in %s", anno, archive_file)
+    logger.info("%d giornate, %d licenze", len(giornate_anno), len(licenze_anno))
 
     return archivio
 
@@ -1625,15 +2104,7 @@ def load_archive(anno: int) -> Optional[Dict]:
 
 def list_archives() -> List[int]:
     """Restituisce la lista degli anni archiviati."""
-    data_dir = BASE_DIR / 'data'
-    archives = []
-    for f in data_dir.glob('archivio_*.json'):
-        try:
-            anno = int(f.stem.replace('archivio_', ''))
-            archives.append(anno)
-        except:
-            pass
-    return sorted(archives)
+    return _list_archive_years()
 
 
 def main():
@@ -1662,86 +2133,113 @@ def main():
             if anno < anno_corrente:
                 archive_file = get_archive_file(anno)
                 if not archive_file.exists():
-                    print(f"\n[AUTO-ARCHIVE] Archiviando anno {anno}...")
+                    logger.info("[AUTO-ARCHIVE] Archiviando anno %d...", anno)
                     archive_year(anno)
 
-    # Determina se è la prima sync per l'anno corrente
-    is_first_sync = existing_data is None or not any(
-        g['data'].startswith(str(anno_corrente))
-        for g in existing_data.get('giornate', [])
+    # Determina se è la prima sync per l'anno corrente: il filtro per anno
+    # vero e proprio avviene dentro merge_with_existing, in un'unica
+    # passata fusa con il dedupe
+    prefisso_anno = f"{anno_corrente}-"
+    giornate_anno_esistenti = sum(
+        1 for g in (existing_data.get('giornate', []) if existing_data else [])
+        if g['data'].startswith(prefisso_anno)
     )
+    is_first_sync = giornate_anno_esistenti == 0
 
     if is_first_sync:
-        print(f"\n[INFO] Prima sincronizzazione {anno_corrente} - scarico tutte le email")
+        logger.info("Prima sincronizzazione %d - scarico tutte le email", anno_corrente)
     else:
-        giornate_anno = [g for g in existing_data.get('giornate', [])
-                         if g['data'].startswith(str(anno_corrente))]
-        print(f"\n[INFO] Sincronizzazione incrementale - ultime 3 settimane")
-        print(f"       Dati esistenti {anno_corrente}: {len(giornate_anno)} giornate")
+        logger.info("Sincronizzazione incrementale - ultime 3 settimane")
+        logger.info("Dati esistenti %d: %d giornate",
+                    anno_corrente, giornate_anno_esistenti)
 
     # Connetti a Gmail
-    print("\nConnessione a Gmail...")
+    logger.info("Connessione a Gmail...")
     service = get_gmail_service()
-    print("Connesso!")
+    logger.info("Connesso!")
 
     # Processa email (solo anno corrente)
     data = process_emails(service, anno=anno_corrente, is_first_sync=is_first_sync)
 
     # Consolida turni
-    print("\nConsolidamento turni...")
+    logger.info("Consolidamento turni...")
     giornate = consolidate_turni(data['turni_per_data'], data['eliminazioni'])
-    print(f"Giornate nuove/aggiornate: {len(giornate)}")
+    logger.info("Giornate nuove/aggiornate: %d", len(giornate))
 
-    # Se non è la prima sync, unisci con i dati esistenti (solo anno corrente)
+    # Se non è la prima sync, unisci con i dati esistenti (il merge
+    # scarta i record fuori anno nella stessa passata del dedupe)
     licenze = data['licenze']
-    if not is_first_sync and existing_data:
-        # Filtra solo dati dell'anno corrente
-        existing_data_filtered = {
-            'giornate': [g for g in existing_data.get('giornate', [])
-                         if g['data'].startswith(str(anno_corrente))],
-            'licenze': [l for l in existing_data.get('licenze', [])
-                        if l.get('data_inizio', '').startswith(str(anno_corrente))]
-        }
-        print("\nUnione con dati esistenti...")
-        giornate, licenze = merge_with_existing(existing_data_filtered, giornate, licenze)
+    if not is_first_sync:
+        logger.info("Unione con dati esistenti...")
+        giornate, licenze = merge_with_existing(existing_data, giornate, licenze,
+                                                anno_corrente)
 
     # Espandi licenze approvate in giornate
     giornate = expand_licenses_to_giornate(giornate, licenze)
 
+    # Ordina per data una volta sola, a valle dell'intera pipeline
+    # (più recente prima): i singoli passaggi non riordinano più
+    giornate.sort(key=attrgetter('data'), reverse=True)
+
     # Calcola statistiche
     stats = calculate_stats(giornate, licenze)
 
     # Salva (solo anno corrente nel file principale)
-    output = save_data(giornate, licenze, stats)
+    save_data(giornate, licenze, stats)
 
     # Aggiungi info sugli archivi disponibili
     archives = list_archives()
     if archives:
-        print(f"\n[INFO] Archivi disponibili: {archives}")
+        logger.info("Archivi disponibili: %s", archives)
+
+    # Riepilogo: il report viene composto in memoria ed emesso con una
+    # sola scrittura invece di una print (e un flush) per riga
+    out = [
+        "",
+        "=" * 60,
+        "RIEPILOGO",
+        "=" * 60,
+        f"Giorni lavorati: {stats['giorni_lavorati']}",
+        f"Ore totali: {stats['ore_totali']}h",
+        f"  - Ordinarie: {stats['ore_ordinarie']}h",
+        f"  - Straordinario: {stats['ore_straordinario']}h",
+        f"Media ore/giorno: {stats['media_ore_giorno']}h",
+        "",
+        "Per tipo servizio:",
+    ]
+    per_tipo = stats.get('per_tipo') or {}
+    per_mese = stats.get('per_mese') or {}
+    licenze_per_tipo = stats.get('licenze_per_tipo')
 
-    # Riepilogo
-    print("\n" + "=" * 60)
-    print("RIEPILOGO")
-    print("=" * 60)
-    print(f"Giorni lavorati: {stats['giorni_lavorati']}")
-    print(f"Ore totali: {stats['ore_totali']}h")
-    print(f"  - Ordinarie: {stats['ore_ordinarie']}h")
-    print(f"  - Straordinario: {stats['ore_straordinario']}h")
-    print(f"Media ore/giorno: {stats['media_ore_giorno']}h")
+    out.extend(
+        f"  - {tipo}: {data['count']} turni, {data['ore']:.1f}h"
+        for tipo, data in per_tipo.items()
+    )
 
-    print("\nPer tipo servizio:")
-    for tipo, data in stats.get('per_tipo', {}).items():
-        print(f"  - {tipo}: {data['count']} turni, {data['ore']:.1f}h")
+    out.append("")
+    out.append("Per mese:")
+    # islice: servono solo i primi 3 mesi, inutile copiare tutto il dict
+    out.extend(
+        f"  - {mese}: {data['giorni']} giorni, {data['ore']:.1f}h totali ({data['ore_straordinario']:.1f}h straord.)"
+        for mese, data in islice(per_mese.items(), 3)
+    )
 
-    print("\nPer mese:")
-    for mese, data in list(stats.get('per_mese', {}).items())[:3]:
-        print(f"  - {mese}: {data['giorni']} giorni, {data['ore']:.1f}h totali ({data['ore_straordinario']:.1f}h straord.)")
+    if licenze_per_tipo:
+        out.append("")
+        out.append("Licenze:")
+        out.extend(
+            f"  - {tipo}: {stati}"
+            for tipo, stati in licenze_per_tipo.items()
+        )
 
-    if stats.get('licenze_per_tipo'):
-        print("\nLicenze:")
-        for tipo, stati in stats['licenze_per_tipo'].items():
-            print(f"  - {tipo}: {stati}")
+    sys.stdout.write("\n".join(out) + "\n")
 
 
 if __name__ == '__main__':
+    # Log per-email a livello DEBUG: di default si vedono solo i traguardi
+    # (LOGLEVEL=DEBUG per il dettaglio completo)
+    logging.basicConfig(
+        level=os.environ.get('LOGLEVEL', 'INFO'),
+        format='%(message)s'
+    )
     main()